@@ -12,22 +12,35 @@ OPTIONS_VALID_SPEC_KEYS = ['default', 'nullable', 'options', 'type']
 def accumulate_parameter_specs(accumulator, parameter_specs):
     return {
         'algorithms': accumulator['algorithms'] + parameter_specs['algorithms'],
+        'find_functions': accumulator['find_functions'] | parameter_specs['find_functions'],
+        'find_many_functions': accumulator['find_many_functions'] | parameter_specs['find_many_functions'],
         # TODO: See if it would be worth cloning parameter specs so that settings would not be shared.
         'parameters': reduce(lambda acc, algorithm: {**acc, algorithm: parameter_specs['parameters']},
                              parameter_specs['algorithms'], accumulator['parameters']),
         'plot_functions': accumulator['plot_functions'] | parameter_specs['plot_functions'],
+        'prepare_functions': accumulator['prepare_functions'] | parameter_specs['prepare_functions'],
     }
 
 
 # TODO: Break these up
 def check_module_parameter_specs(module_name, parameter_specs):
     path = f'{module_name}.PARAMETER_SPECS'
-    if sorted(parameter_specs.keys()) != ['algorithms', 'parameters', 'plot_functions']:
+    if sorted(parameter_specs.keys()) != ['algorithms', 'find_functions', 'find_many_functions', 'parameters',
+                                             'plot_functions', 'prepare_functions']:
         raise Exception(f'There are unexpected keys in {path} object:', sorted(parameter_specs.keys()))
     algorithms = sorted(parameter_specs['algorithms'])
     if algorithms != sorted(parameter_specs['plot_functions'].keys()):
         raise Exception('There is a difference between the declared algorithms and the ones collected from '
                         f'{path}["plot_functions"].')
+    if algorithms != sorted(parameter_specs['find_functions'].keys()):
+        raise Exception('There is a difference between the declared algorithms and the ones collected from '
+                        f'{path}["find_functions"].')
+    if algorithms != sorted(parameter_specs['find_many_functions'].keys()):
+        raise Exception('There is a difference between the declared algorithms and the ones collected from '
+                        f'{path}["find_many_functions"].')
+    if algorithms != sorted(parameter_specs['prepare_functions'].keys()):
+        raise Exception('There is a difference between the declared algorithms and the ones collected from '
+                        f'{path}["prepare_functions"].')
     collector = {'algorithm': {'type': str, 'options': algorithms}}
     path = f'{path}["parameters"]'
     for index, conditional in enumerate(parameter_specs['parameters']):
@@ -109,7 +122,8 @@ for algorithmic_module in MODULES:
     check_module_parameter_specs(algorithmic_module.__name__, algorithmic_module.PARAMETER_SPECS)
 
 PARAMETER_SPECS = reduce(lambda acc, module: accumulate_parameter_specs(acc, module.PARAMETER_SPECS), MODULES,
-                         {'algorithms': [], 'parameters': {}, 'plot_functions': {}})
+                         {'algorithms': [], 'find_functions': {}, 'find_many_functions': {}, 'parameters': {},
+                          'plot_functions': {}, 'prepare_functions': {}})
 
 # DEBUGGING:
 # import json
@@ -1,9 +1,12 @@
 from .algorithms import ALGORITHM_BF, ALGORITHM_FLANN
 from .detectors import DETECTOR_BRIEF, DETECTOR_ORB, DETECTOR_SIFT, DETECTOR_PARAM_SPECS
+from .finding import HOMOGRAPHY_PARAM_SPECS, find, prepare
 from .match_filters import MATCH_FILTERING_PARAM_SPECS
 from .matchers import MATCHING_METHOD_BEST, MATCHING_METHOD_KNN, MATCHING_METHOD_RADIUS, MATCHER_PARAM_SPECS, \
     MATCHING_METHOD_PARAM_SPECS
+from .multi_template import find_many
 from .plotting import plot
+from algorithms.region import REGION_PARAM_SPECS
 from image_filters.color_space import COLOR_PARAM_SPECS
 
 
@@ -24,14 +27,28 @@ PARAMETER_SPECS = {
     'algorithms': [ALGORITHM_BF, ALGORITHM_FLANN],
     'parameters': [
         {'': {'all': COLOR_PARAM_SPECS}},
+        {'': {'all': REGION_PARAM_SPECS}},
         {'algorithm': ALGORITHM_PARAMS},
         {'detector': DETECTOR_PARAM_SPECS},
         {'algorithm': MATCHER_PARAM_SPECS},
         {'matching_method': MATCHING_METHOD_PARAM_SPECS},
         *MATCH_FILTERING_PARAM_SPECS,
+        {'': {'all': HOMOGRAPHY_PARAM_SPECS}},
     ],
+    'find_functions': {
+        ALGORITHM_BF: find,
+        ALGORITHM_FLANN: find,
+    },
+    'find_many_functions': {
+        ALGORITHM_BF: find_many,
+        ALGORITHM_FLANN: find_many,
+    },
     'plot_functions': {
         ALGORITHM_BF: plot,
         ALGORITHM_FLANN: plot,
     },
+    'prepare_functions': {
+        ALGORITHM_BF: prepare,
+        ALGORITHM_FLANN: prepare,
+    },
 }
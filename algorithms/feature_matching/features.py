@@ -0,0 +1,30 @@
+from .detectors import DETECTOR_PARAM_SPECS
+from caching import LRUCache, MEGABYTE, hash_image, register_cache
+from utils import filter_dict_keys
+
+
+# Rough in-memory size of a cv2.KeyPoint, used for the cache budget.
+KEYPOINT_BYTES = 96
+
+FEATURE_CACHE = register_cache('features', LRUCache(512 * MEGABYTE))
+
+
+def detect_and_compute(detector_object, image, working_image, color_space: str, detector: str, mask=None, **kwargs):
+    key = feature_key(image, color_space, detector, mask, **kwargs)
+    features = FEATURE_CACHE.get(key)
+    if features is None:
+        features = detector_object.detectAndCompute(working_image, mask)
+        store_features(key, features)
+    return features
+
+
+def feature_key(image, color_space: str, detector: str, mask=None, **kwargs):
+    detector_params = filter_dict_keys(kwargs, DETECTOR_PARAM_SPECS[detector].keys())
+    return hash_image(image), None if mask is None else hash_image(mask), color_space, detector, \
+        tuple(sorted(detector_params.items()))
+
+
+# Also used for features computed elsewhere (e.g. template libraries), so that they are not detected again.
+def store_features(key, features):
+    kp, desc = features
+    FEATURE_CACHE.put(key, features, len(kp) * KEYPOINT_BYTES + (0 if desc is None else desc.nbytes))
@@ -0,0 +1,110 @@
+import cv2
+import numpy
+import sys
+from .features import detect_and_compute, feature_key
+from .match_arrays import count_matches, get_keypoint_points
+from .match_filters import filter_matches
+from .matchers import use_matcher
+from .pools import get_detector, get_trained_matcher
+from algorithms.region import crop_to_region, get_region
+from image_filters.color_space import change_color_space_from_bgr
+from timer import Timer
+from utils import print_traceback
+
+
+HOMOGRAPHY_PARAM_SPECS = {
+    # RANSAC picks some homography from any 4 matches, so fewer inliers than these are not taken as a match.
+    'min_inliers': {'type': int, 'min': 4, 'max': 100, 'step': 1, 'default': 6},
+}
+
+# Outlines (in base pixels) smaller than this, or than this fraction of the template area, have collapsed.
+MIN_OUTLINE_AREA = 16
+MIN_OUTLINE_AREA_RATIO = 0.01
+
+
+def _is_plausible_outline(outline, query_outline):
+    # Mirrored (reversed), self-intersecting (non-convex) or collapsed outlines come from degenerate homographies.
+    query_area = cv2.contourArea(query_outline, oriented=True)
+    area = cv2.contourArea(outline, oriented=True) * (1 if query_area > 0 else -1)
+    return bool(cv2.isContourConvex(outline)) and \
+        area > max(MIN_OUTLINE_AREA, abs(query_area) * MIN_OUTLINE_AREA_RATIO)
+
+
+def find(base_image, query_image, algorithm: str, **kwargs):
+    located = {'matches': []}
+    timer = Timer(f'{algorithm} find', base_size=list(base_image.shape), query_size=list(query_image.shape))
+    timer.start()
+    try:
+        matched = match_features(base_image, query_image, timer, algorithm, **kwargs)
+        located = {'matches': matched['located'], 'homography': matched['homography'],
+                   'keypoints': {'base': len(matched['base_kp']), 'query': len(matched['query_kp'])}}
+    except:
+        print_traceback(sys.exc_info())
+        timer.mark('Exception handling')
+    return {'duration': timer.stop(), **located}
+
+
+def locate_outline(query_shape, match_arrays: dict, min_inliers: int = 6, **kwargs):
+    src_pts = match_arrays['query_points'].reshape(-1, 1, 2)
+    dst_pts = match_arrays['base_points'].reshape(-1, 1, 2)
+    if len(src_pts) < max(min_inliers, 4):
+        return None, None
+    t_matrix, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+    if t_matrix is None or int(mask.sum()) < min_inliers:
+        return None, None
+    qh, qw = query_shape[:2]
+    pts = numpy.float32([[0, 0], [0, qh - 1], [qw - 1, qh - 1], [qw - 1, 0]]).reshape(-1, 1, 2)
+    outline = cv2.perspectiveTransform(pts, t_matrix)
+    if not _is_plausible_outline(outline, pts):
+        return None, None
+    return t_matrix, {'box': list(cv2.boundingRect(outline)), 'outline': outline.reshape(-1, 2).tolist(),
+                      'score': int(mask.sum())}
+
+
+def match_features(base_image, query_image, timer: Timer, algorithm: str, color_space: str, detector: str,
+                   matching_method: str, match_filters_by: str, prepared_base: dict = None, **kwargs):
+    if prepared_base is None:
+        prepared_base = prepare(base_image, algorithm, color_space, detector, **kwargs)
+        timer.mark('Base preparation', keypoints=len(prepared_base['base_kp']))
+    working_base_image, base_kp, base_desc = \
+        prepared_base['working_base_image'], prepared_base['base_kp'], prepared_base['base_desc']
+    working_query_image = change_color_space_from_bgr(color_space, [query_image])[0]
+    timer.mark(f'Query color space change BGR->{color_space}')
+    detector_object = get_detector(detector, **kwargs)
+    timer.mark(f'Detector {detector} lookup')
+    query_kp, query_desc = detect_and_compute(detector_object, query_image, working_query_image, color_space, detector,
+                                              **kwargs)
+    timer.mark('Query feature detection', keypoints=len(query_kp))
+    # Trained matchers are not shared between threads, so they are looked up here instead of being prepared.
+    matcher_object = get_trained_matcher(algorithm, prepared_base['base_key'], base_desc, matching_method, **kwargs)
+    timer.mark(f'{algorithm} matcher lookup/training')
+    matches = use_matcher(matcher_object, matching_method, query_desc, prepared_base['base_points'],
+                          get_keypoint_points(query_kp), **kwargs)
+    timer.mark(f'{algorithm} matching', matches=count_matches(matches))
+    filtered_matches = filter_matches(match_filters_by, matching_method, matches, **kwargs)
+    timer.mark(f'Filter matches by {match_filters_by}', matches=count_matches(filtered_matches))
+    homography = None
+    located = []
+    try:
+        t_matrix, outline = locate_outline(working_query_image.shape, filtered_matches, **kwargs)
+        if outline is not None:
+            homography = t_matrix.tolist()
+            located.append(outline)
+    except:
+        print_traceback(sys.exc_info())
+    timer.mark('Homography', located=len(located))
+    return {'working_base_image': working_base_image, 'working_query_image': working_query_image,
+            'base_kp': base_kp, 'query_kp': query_kp, 'matches': filtered_matches, 'homography': homography,
+            'located': located, 'region': prepared_base['region']}
+
+
+def prepare(base_image, algorithm: str, color_space: str, detector: str, **kwargs):
+    region = get_region(base_image.shape, **kwargs)
+    region_image = crop_to_region(base_image, region)
+    working_base_image = change_color_space_from_bgr(color_space, [region_image])[0]
+    base_kp, base_desc = detect_and_compute(get_detector(detector, **kwargs), region_image, working_base_image,
+                                            color_space, detector, region['mask'], **kwargs)
+    # Keypoints stay relative to the region (as cached), while their points are moved back onto the whole base.
+    return {'working_base_image': working_base_image, 'base_kp': base_kp, 'base_desc': base_desc,
+            'base_points': get_keypoint_points(base_kp) + numpy.float32(region['box'][:2]),
+            'base_key': feature_key(region_image, color_space, detector, region['mask'], **kwargs), 'region': region}
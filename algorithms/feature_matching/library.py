@@ -0,0 +1,195 @@
+import cv2
+import json
+import numpy
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .detectors import DETECTOR_PARAM_SPECS
+from .features import detect_and_compute, feature_key, store_features
+from .pools import get_detector
+from image_filters.color_space import change_color_space_from_bgr
+from images import load_image
+from timer import Timer
+from utils import filter_dict_keys
+
+
+LIBRARY_VERSION = 1
+METADATA_FILENAME = 'library.json'
+
+DEFAULT_BRANCHING = 10
+DEFAULT_DEPTH = 3
+# Descriptors used for training the vocabulary (sampled evenly across the library), which is all k-means needs.
+MAX_TRAINING_DESCRIPTORS = 100000
+# Descriptors quantized at once, which bounds the memory used for their distances to the tree nodes.
+QUANTIZATION_CHUNK_SIZE = 4096
+
+
+def _get_children(nodes, branching: int):
+    # The tree is stored in heap order: the children of node n are n * branching + 1, ..., n * branching + branching.
+    return nodes[:, None] * branching + 1 + numpy.arange(branching)
+
+
+def _get_first_leaf(branching: int, depth: int):
+    return (branching ** depth - 1) // (branching - 1)
+
+
+def _save_arrays(directory: str, arrays: dict):
+    for name, array in arrays.items():
+        numpy.save(os.path.join(directory, f'{name}.npy'), array)
+
+
+def _to_vocabulary_space(descriptors, binary: bool):
+    # Binary descriptors are clustered bit by bit, as k-means needs a vector space.
+    return numpy.unpackbits(descriptors, axis=1).astype(numpy.float32) if binary else descriptors.astype(numpy.float32)
+
+
+class TemplateLibrary:
+    # Arrays are memory-mapped, so only the parts actually used (e.g. the candidates' descriptors) are read.
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, METADATA_FILENAME), 'r', encoding='utf-8') as f:
+            self._metadata = json.load(f)
+        if self._metadata['version'] != LIBRARY_VERSION:
+            raise Exception(f'Template library {directory} has an unsupported version: {self._metadata["version"]}.')
+        self._indices = {filename: index for index, filename in enumerate(self._metadata['filenames'])}
+        self._arrays = {name: numpy.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+                        for name in ['descriptors', 'idf', 'keypoints', 'offsets', 'posting_counts',
+                                     'posting_templates', 'template_norms', 'vocabulary', 'word_offsets']}
+
+    def _get_features(self, index: int):
+        start, end = self._arrays['offsets'][index:index + 2]
+        keypoints = [cv2.KeyPoint(x, y, size, angle, response, int(octave), int(class_id))
+                     for x, y, size, angle, response, octave, class_id in self._arrays['keypoints'][start:end]]
+        return tuple(keypoints), numpy.array(self._arrays['descriptors'][start:end])
+
+    def get_candidates(self, base_image, count: int):
+        timer = Timer('Library candidates', base_size=list(base_image.shape),
+                      templates=len(self._metadata['filenames']))
+        timer.start()
+        color_space, detector, detector_params = \
+            self._metadata['color_space'], self._metadata['detector'], self._metadata['detector_params']
+        working_base_image = change_color_space_from_bgr(color_space, [base_image])[0]
+        base_kp, base_desc = detect_and_compute(get_detector(detector, **detector_params), base_image,
+                                                working_base_image, color_space, detector, **detector_params)
+        timer.mark('Base feature detection', keypoints=len(base_kp))
+        scores = self.score(base_desc)
+        timer.mark('Scoring')
+        candidates = numpy.argpartition(-scores, count - 1)[:count] if count < len(scores) else \
+            numpy.arange(len(scores))
+        candidates = candidates[numpy.argsort(-scores[candidates], kind='stable')]
+        return {'duration': timer.stop(), 'candidates': [{'query': self._metadata['filenames'][index],
+                                                          'score': float(scores[index])} for index in candidates]}
+
+    def get_filenames(self):
+        return list(self._metadata['filenames'])
+
+    def score(self, descriptors):
+        template_count = len(self._metadata['filenames'])
+        if descriptors is None or len(descriptors) == 0:
+            return numpy.zeros(template_count)
+        words, counts = numpy.unique(quantize(self._arrays['vocabulary'], self._metadata['branching'],
+                                              self._metadata['depth'], descriptors, self._metadata['binary']),
+                                     return_counts=True)
+        # Only the postings of the words found in the base are visited, however large the library is.
+        starts = self._arrays['word_offsets'][words]
+        lengths = self._arrays['word_offsets'][words + 1] - starts
+        postings = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths) + \
+            numpy.repeat(starts, lengths)
+        # Histogram intersection: how much of each template's (IDF weighted) visual words the base contains.
+        overlaps = numpy.minimum(self._arrays['posting_counts'][postings], numpy.repeat(counts, lengths)) * \
+            numpy.repeat(self._arrays['idf'][words], lengths)
+        scores = numpy.bincount(self._arrays['posting_templates'][postings], weights=overlaps,
+                                minlength=template_count)
+        return scores / numpy.maximum(self._arrays['template_norms'], 1e-9)
+
+    def seed_features(self, filename: str, image, settings: dict):
+        # Stored features are only valid for the very same detection settings.
+        if settings.get('detector') != self._metadata['detector'] or \
+                settings.get('color_space') != self._metadata['color_space'] or \
+                filter_dict_keys(settings, DETECTOR_PARAM_SPECS[self._metadata['detector']].keys()) != \
+                self._metadata['detector_params'] or filename not in self._indices:
+            return
+        store_features(feature_key(image, **settings), self._get_features(self._indices[filename]))
+
+
+def build_library(directory: str, filenames: list[str], color_space: str, detector: str, detector_params: dict,
+                  branching: int = DEFAULT_BRANCHING, depth: int = DEFAULT_DEPTH, threads: int = None):
+
+    def extract(filename: str):
+        image = load_image(filename)
+        working_image = change_color_space_from_bgr(color_space, [image])[0]
+        keypoints, descriptors = get_detector(detector, **detector_params).detectAndCompute(working_image, None)
+        if descriptors is None:
+            return [], None
+        return [[*kp.pt, kp.size, kp.angle, kp.response, kp.octave, kp.class_id] for kp in keypoints], descriptors
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        extracted = list(executor.map(extract, filenames))
+    descriptor_arrays = [descriptors for _, descriptors in extracted if descriptors is not None]
+    if len(descriptor_arrays) == 0:
+        raise Exception('No features found on any of the templates.')
+    empty = numpy.zeros((0, descriptor_arrays[0].shape[1]), descriptor_arrays[0].dtype)
+    descriptors = numpy.concatenate([empty if descriptors is None else descriptors for _, descriptors in extracted])
+    keypoints = numpy.float32([keypoint for keypoints, _ in extracted for keypoint in keypoints]).reshape(-1, 7)
+    offsets = numpy.concatenate([[0], numpy.cumsum([0 if d is None else len(d) for _, d in extracted])])
+    binary = descriptors.dtype == numpy.uint8
+    sample = descriptors[numpy.linspace(0, len(descriptors) - 1, min(len(descriptors), MAX_TRAINING_DESCRIPTORS),
+                                        dtype=numpy.int64)]
+    vocabulary = train_vocabulary(_to_vocabulary_space(sample, binary), branching, depth)
+    word_count = branching ** depth
+    # Inverted index: for every visual word, the templates containing it (and how many times).
+    template_ids = numpy.repeat(numpy.arange(len(filenames)), numpy.diff(offsets))
+    pairs, posting_counts = numpy.unique(
+        numpy.stack([quantize(vocabulary, branching, depth, descriptors, binary), template_ids], axis=1), axis=0,
+        return_counts=True)
+    word_offsets = numpy.searchsorted(pairs[:, 0], numpy.arange(word_count + 1))
+    idf = numpy.log(len(filenames) / numpy.maximum(numpy.bincount(pairs[:, 0], minlength=word_count), 1))
+    template_norms = numpy.bincount(pairs[:, 1], weights=posting_counts * idf[pairs[:, 0]], minlength=len(filenames))
+    os.makedirs(directory, exist_ok=True)
+    _save_arrays(directory, {
+        'descriptors': descriptors, 'idf': idf, 'keypoints': keypoints, 'offsets': offsets,
+        'posting_counts': posting_counts.astype(numpy.float32), 'posting_templates': pairs[:, 1].astype(numpy.int32),
+        'template_norms': template_norms, 'vocabulary': vocabulary, 'word_offsets': word_offsets,
+    })
+    # Metadata goes last, as it is the file that marks the library as complete.
+    with open(os.path.join(directory, METADATA_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({'version': LIBRARY_VERSION, 'color_space': color_space, 'detector': detector,
+                   'detector_params': detector_params, 'branching': branching, 'depth': depth, 'binary': bool(binary),
+                   'filenames': filenames}, f, indent=4)
+
+
+def quantize(vocabulary, branching: int, depth: int, descriptors, binary: bool):
+    words = numpy.empty(len(descriptors), numpy.int64)
+    squared_norms = numpy.einsum('ij,ij->i', vocabulary, vocabulary)
+    for start in range(0, len(descriptors), QUANTIZATION_CHUNK_SIZE):
+        chunk = _to_vocabulary_space(descriptors[start:start + QUANTIZATION_CHUNK_SIZE], binary)
+        nodes = numpy.zeros(len(chunk), numpy.int64)
+        for _ in range(depth):
+            children = _get_children(nodes, branching)
+            # Squared distances, minus the descriptors' own norm (which does not change the closest child).
+            distances = squared_norms[children] - 2 * numpy.einsum('ikj,ij->ik', vocabulary[children], chunk)
+            nodes = children[numpy.arange(len(chunk)), numpy.argmin(distances, axis=1)]
+        words[start:start + len(chunk)] = nodes - _get_first_leaf(branching, depth)
+    return words
+
+
+def train_vocabulary(samples, branching: int, depth: int):
+    # Hierarchical k-means (a vocabulary tree): every node's descriptors are split into as many clusters as branches.
+    vocabulary = numpy.zeros(((branching ** (depth + 1) - 1) // (branching - 1), samples.shape[1]), numpy.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+    cv2.setRNGSeed(0)
+    pending = [(0, samples, 0)]
+    while len(pending) > 0:
+        node, node_samples, level = pending.pop()
+        if level == depth:
+            continue
+        children = _get_children(numpy.array([node]), branching)[0]
+        if len(node_samples) > branching:
+            _, labels, centers = cv2.kmeans(node_samples, branching, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+            labels = labels.ravel()
+        else:
+            # Too few descriptors to split: children repeat them (or their parent), so that every leaf is reachable.
+            centers = node_samples[numpy.arange(branching) % len(node_samples)] if len(node_samples) > 0 else \
+                numpy.repeat(vocabulary[node:node + 1], branching, axis=0)
+            labels = numpy.arange(len(node_samples))
+        vocabulary[children] = centers
+        pending.extend((child, node_samples[labels == index], level + 1) for index, child in enumerate(children))
+    return vocabulary
@@ -0,0 +1,43 @@
+import cv2
+import numpy
+
+
+# Matches travel through the pipeline as parallel arrays (one element per match), instead of cv2.DMatch objects:
+#   base_idx, query_idx: keypoint indices on each image.
+#   distance: descriptor distance.
+#   second_distance: distance to the second best base keypoint (KNN only, infinite otherwise), for ratio tests.
+#   base_points, query_points: keypoint coordinates on each image (one row per match).
+MATCH_ARRAY_KEYS = ['base_idx', 'query_idx', 'distance', 'second_distance', 'base_points', 'query_points']
+
+
+def count_matches(match_arrays: dict):
+    return len(match_arrays['distance'])
+
+
+# Matchers are trained with the base descriptors, so their DMatch queryIdx refers to the query and trainIdx to the base.
+def create_match_arrays(matches: list[cv2.DMatch], base_points, query_points, second_distance=None):
+    count = len(matches)
+    base_idx = numpy.fromiter((match.trainIdx for match in matches), numpy.int32, count)
+    query_idx = numpy.fromiter((match.queryIdx for match in matches), numpy.int32, count)
+    return {
+        'base_idx': base_idx,
+        'query_idx': query_idx,
+        'distance': numpy.fromiter((match.distance for match in matches), numpy.float32, count),
+        'second_distance': numpy.full(count, numpy.inf, numpy.float32) if second_distance is None else second_distance,
+        'base_points': base_points[base_idx],
+        'query_points': query_points[query_idx],
+    }
+
+
+def get_keypoint_points(keypoints):
+    return numpy.float32(cv2.KeyPoint_convert(keypoints)).reshape(-1, 2)
+
+
+def select_matches(match_arrays: dict, selected):
+    return {key: match_arrays[key][selected] for key in MATCH_ARRAY_KEYS}
+
+
+# Only for drawing, as cv2.drawMatches takes DMatch objects (and the base as its first image).
+def to_dmatches(match_arrays: dict):
+    return [cv2.DMatch(int(base_idx), int(query_idx), float(distance)) for base_idx, query_idx, distance in
+            zip(match_arrays['base_idx'], match_arrays['query_idx'], match_arrays['distance'])]
@@ -1,6 +1,7 @@
+import numpy
+from .match_arrays import select_matches
 from .matchers import MATCHING_METHOD_BEST, MATCHING_METHOD_KNN, MATCHING_METHOD_RADIUS
 
-# TODO: Improve performance of match filtering.
 
 MATCH_FILTERING_TOP_N = 'top N'
 MATCH_FILTERING_RATIO = 'ratio threshold'
@@ -18,24 +19,25 @@ MATCH_FILTERING_PARAM_SPECS = [
 ]
 
 
-def filter_matches_by_lowe(all_matches, match_ratio_threshold: float, **kwargs):
-    return [match for match in all_matches if match.distance < match_ratio_threshold]
+def filter_in_top_n_matches(match_arrays: dict, n_matches: int, **kwargs):
+    distances = match_arrays['distance']
+    candidates = numpy.flatnonzero(numpy.isfinite(distances))
+    if n_matches < len(candidates):
+        # Only the N best are sorted, instead of every match.
+        candidates = candidates[numpy.argpartition(distances[candidates], n_matches - 1)[:n_matches]]
+    return candidates[numpy.argsort(distances[candidates], kind='stable')]
 
 
-def filter_in_top_n_matches(all_matches, n_matches: int, **kwargs):
-    return sorted(all_matches, key=lambda m: m.distance)[:n_matches]
+def filter_matches(match_filters_by: str, matching_method: str, match_arrays: dict, **kwargs):
+    return select_matches(match_arrays, MATCH_FILTERS[match_filters_by][matching_method](match_arrays, **kwargs))
 
 
-def filter_pairs_by_lowe(all_matches, match_ratio_threshold: float, **kwargs):
-    return [pair for pair in all_matches if pair[0].distance < match_ratio_threshold * pair[1].distance]
+def filter_matches_by_lowe(match_arrays: dict, match_ratio_threshold: float, **kwargs):
+    return numpy.flatnonzero(match_arrays['distance'] < match_ratio_threshold)
 
 
-def filter_in_top_n_pairs(all_matches, n_matches: int, **kwargs):
-    return sorted(all_matches, key=lambda m: m[0].distance)[:n_matches]
-
-
-def filter_matches(match_filters_by: str, matching_method: str, all_matches, **kwargs):
-    return MATCH_FILTERS[match_filters_by][matching_method](all_matches, **kwargs)
+def filter_pairs_by_lowe(match_arrays: dict, match_ratio_threshold: float, **kwargs):
+    return numpy.flatnonzero(match_arrays['distance'] < match_ratio_threshold * match_arrays['second_distance'])
 
 
 MATCH_FILTERS = {
@@ -46,7 +48,7 @@ MATCH_FILTERS = {
     },
     MATCH_FILTERING_TOP_N: {
         MATCHING_METHOD_BEST: filter_in_top_n_matches,
-        MATCHING_METHOD_KNN: filter_in_top_n_pairs,
+        MATCHING_METHOD_KNN: filter_in_top_n_matches,
         MATCHING_METHOD_RADIUS: filter_in_top_n_matches,
     },
 }
@@ -1,8 +1,13 @@
 import cv2
+import numpy
 import sys
 from .algorithms import ALGORITHM_BF, ALGORITHM_FLANN
+from .match_arrays import create_match_arrays
 
 
+FLANN_INDEX_KDTREE = 'KD-tree'
+FLANN_INDEX_KMEANS = 'k-means'
+FLANN_INDEX_LSH = 'LSH'
 MATCHING_METHOD_BEST = 'best'
 MATCHING_METHOD_KNN = 'KNN'
 MATCHING_METHOD_RADIUS = 'radius-based'
@@ -21,9 +26,17 @@ MATCHER_PARAM_SPECS = {
         },
         'cross_check': {'type': bool, 'nullable': True, 'default': None},
     },
+    # The index type depends on the descriptors: LSH for binary ones (BRIEF, ORB), and the float_index one for the rest.
     ALGORITHM_FLANN: {
-        'trees': {'type': int, 'min': 1, 'max': 1000, 'step': 1, 'default': 100},
-        'checks': {'type': int, 'min': 1, 'max': 1000, 'step': 1, 'default': 500},
+        'float_index': {'type': str, 'options': [FLANN_INDEX_KDTREE, FLANN_INDEX_KMEANS],
+                        'default': FLANN_INDEX_KDTREE},
+        'trees': {'type': int, 'min': 1, 'max': 64, 'step': 1, 'default': 5},
+        'branching': {'type': int, 'min': 2, 'max': 256, 'step': 1, 'default': 32},
+        'iterations': {'type': int, 'min': 1, 'max': 100, 'step': 1, 'default': 11},
+        'table_number': {'type': int, 'min': 1, 'max': 32, 'step': 1, 'default': 6},
+        'key_size': {'type': int, 'min': 1, 'max': 32, 'step': 1, 'default': 12},
+        'multi_probe_level': {'type': int, 'min': 0, 'max': 4, 'step': 1, 'default': 1},
+        'checks': {'type': int, 'min': 1, 'max': 1000, 'step': 1, 'default': 50},
     },
 }
 
@@ -36,12 +49,19 @@ MATCHING_METHOD_PARAM_SPECS = {
         # 'compactResult': {'type': bool, 'nullable': True, 'default': None},  # Only used for masks.
     },
     MATCHING_METHOD_RADIUS: {
-        # TODO: See what range this one has.
-        'maxDistance': {'type': float, 'min': 0.0, 'max': 1.0, 'step': 0.01, 'default': 0.5},
+        # Descriptor distances: Hamming ones (BRIEF, ORB) go up to 256, and L2 ones (SIFT) are of the same order.
+        'maxDistance': {'type': float, 'min': 0.0, 'max': 256.0, 'step': 0.01, 'default': 0.5},
         # 'compactResult': {'type': bool, 'nullable': True, 'default': None},  # Only used for masks.
     },
 }
 
+# As numbered by FLANN (cv2.flann_Index has no named constants for them).
+FLANN_INDEX_ALGORITHMS = {
+    FLANN_INDEX_KDTREE: 1,
+    FLANN_INDEX_KMEANS: 2,
+    FLANN_INDEX_LSH: 6,
+}
+
 NORMALIZATION_TYPES = {
     NORMALIZATION_TYPE_L1: cv2.NORM_L1,
     NORMALIZATION_TYPE_L2: cv2.NORM_L2,
@@ -54,8 +74,18 @@ def create_bruteforce_matcher(norm_type: str = 'NORM_HAMMING', cross_check: bool
     return cv2.BFMatcher(NORMALIZATION_TYPES[norm_type], crossCheck=cross_check)
 
 
-def create_flann_matcher(trees: int = 100, checks: int = 500, **kwargs):
-    index_params = dict(algorithm=cv2.DESCRIPTOR_MATCHER_FLANNBASED, trees=trees)
+def create_flann_matcher(descriptor_dtype=numpy.float32, float_index: str = FLANN_INDEX_KDTREE, trees: int = 5,
+                         branching: int = 32, iterations: int = 11, table_number: int = 6, key_size: int = 12,
+                         multi_probe_level: int = 1, checks: int = 50, **kwargs):
+    if descriptor_dtype == numpy.uint8:
+        # Binary descriptors are compared by Hamming distance, which KD-trees and k-means know nothing about.
+        index_params = dict(algorithm=FLANN_INDEX_ALGORITHMS[FLANN_INDEX_LSH], table_number=table_number,
+                            key_size=key_size, multi_probe_level=multi_probe_level)
+    elif float_index == FLANN_INDEX_KMEANS:
+        index_params = dict(algorithm=FLANN_INDEX_ALGORITHMS[FLANN_INDEX_KMEANS], branching=branching,
+                            iterations=iterations)
+    else:
+        index_params = dict(algorithm=FLANN_INDEX_ALGORITHMS[FLANN_INDEX_KDTREE], trees=trees)
     search_params = dict(checks=checks)
     return cv2.FlannBasedMatcher(index_params, search_params)
 
@@ -64,22 +94,42 @@ def create_matcher(matcher: str, **kwargs):
     return MATCHERS[matcher](**kwargs)
 
 
-def use_best_matching(matcher, base_kp, base_desc, query_kp, query_desc, **kwargs):
-    return matcher.match(base_desc, query_desc)
+def create_trained_matcher(matcher: str, base_desc, **kwargs):
+    matcher_object = create_matcher(matcher, descriptor_dtype=base_desc.dtype, **kwargs)
+    matcher_object.add([base_desc])
+    matcher_object.train()
+    return matcher_object
+
+
+def resolve_matcher(matcher: str, matching_method: str, descriptor_dtype):
+    # FLANN's LSH index (the one for binary descriptors) has no radius search, so those are brute forced instead.
+    if matcher == ALGORITHM_FLANN and matching_method == MATCHING_METHOD_RADIUS and descriptor_dtype == numpy.uint8:
+        return ALGORITHM_BF
+    return matcher
+
+
+def use_best_matching(matcher, query_desc, base_points, query_points, **kwargs):
+    return create_match_arrays(matcher.match(query_desc), base_points, query_points)
 
 
-def use_knn_matching(matcher, base_kp, base_desc, query_kp, query_desc, k: int, **kwargs):
-    if len(query_kp) <= 1:
-        print(f'Insufficient number of Query KPs: {query_kp}', file=sys.stderr)
-    return matcher.knnMatch(base_desc, query_desc, k=k) if len(query_kp) > 1 else []
+def use_knn_matching(matcher, query_desc, base_points, query_points, k: int, **kwargs):
+    if len(query_points) <= 1:
+        print(f'Insufficient number of Query KPs: {len(query_points)}', file=sys.stderr)
+        return create_match_arrays([], base_points, query_points)
+    # Only the best match of each query keypoint is kept, along with the second best distance for ratio tests.
+    neighbours = [matches for matches in matcher.knnMatch(query_desc, k=k) if len(matches) > 0]
+    second_distance = numpy.fromiter((matches[1].distance if len(matches) > 1 else numpy.inf
+                                      for matches in neighbours), numpy.float32, len(neighbours))
+    return create_match_arrays([matches[0] for matches in neighbours], base_points, query_points, second_distance)
 
 
-def use_radius_best_matching(matcher, base_kp, base_desc, query_kp, query_desc, maxDistance: float, **kwargs):
-    return matcher.radiusMatch(base_desc, query_desc, maxDistance=maxDistance)
+def use_radius_best_matching(matcher, query_desc, base_points, query_points, maxDistance: float, **kwargs):
+    return create_match_arrays([match for matches in matcher.radiusMatch(query_desc, maxDistance=maxDistance)
+                                for match in matches], base_points, query_points)
 
 
-def use_matcher(matcher, matching_method, base_kp, base_desc, query_kp, query_desc, **kwargs):
-    return MATCHER_USES[matching_method](matcher, base_kp, base_desc, query_kp, query_desc, **kwargs)
+def use_matcher(matcher, matching_method, query_desc, base_points, query_points, **kwargs):
+    return MATCHER_USES[matching_method](matcher, query_desc, base_points, query_points, **kwargs)
 
 
 MATCHER_USES = {
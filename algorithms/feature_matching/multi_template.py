@@ -0,0 +1,133 @@
+import numpy
+import sys
+from .features import detect_and_compute
+from .finding import find, locate_outline, prepare
+from .match_arrays import count_matches, get_keypoint_points
+from .match_filters import filter_matches
+from .matchers import MATCHER_PARAM_SPECS, MATCHING_METHOD_RADIUS, create_trained_matcher
+from .pools import get_detector
+from image_filters.color_space import change_color_space_from_bgr
+from timer import Timer
+from utils import filter_dict_keys, print_traceback
+
+
+# Base keypoints are matched to this many nearest template keypoints, across all templates at once.
+MULTI_TEMPLATE_NEIGHBOURS = 8
+
+
+def _find_in_template(query_image, algorithm: str, matching_method: str, match_filters_by: str, match_arrays: dict,
+                      **kwargs):
+    timer = Timer(f'{algorithm} template', query_size=list(query_image.shape))
+    timer.start()
+    filtered_matches = filter_matches(match_filters_by, matching_method, match_arrays, **kwargs)
+    timer.mark(f'Filter matches by {match_filters_by}', matches=count_matches(filtered_matches))
+    homography = None
+    located = []
+    try:
+        t_matrix, outline = locate_outline(query_image.shape, filtered_matches, **kwargs)
+        if outline is not None:
+            homography = t_matrix.tolist()
+            located.append(outline)
+    except:
+        print_traceback(sys.exc_info())
+    timer.mark('Homography', located=len(located))
+    return timer.stop(), {'matches': located, 'homography': homography}
+
+
+def _match_together(base_image, query_images: list, timer: Timer, algorithm: str, color_space: str, detector: str,
+                    prepared_base: dict = None, **kwargs):
+    if prepared_base is None:
+        prepared_base = prepare(base_image, algorithm, color_space, detector, **kwargs)
+        timer.mark('Base preparation', keypoints=len(prepared_base['base_kp']))
+    detector_object = get_detector(detector, **kwargs)
+    working_query_images = change_color_space_from_bgr(color_space, query_images)
+    features = [detect_and_compute(detector_object, query_image, working_query_image, color_space, detector, **kwargs)
+                for query_image, working_query_image in zip(query_images, working_query_images)]
+    timer.mark('Query feature detection', keypoints=sum(len(query_kp) for query_kp, _ in features))
+    descriptor_arrays = [query_desc for _, query_desc in features if query_desc is not None]
+    base_desc = prepared_base['base_desc']
+    per_template = None
+    if len(descriptor_arrays) > 0 and base_desc is not None and len(base_desc) > 0:
+        # Every template's descriptors go into a single index, along with the template each row comes from.
+        counts = [0 if query_desc is None else len(query_desc) for _, query_desc in features]
+        stacked_desc = numpy.concatenate(descriptor_arrays)
+        template_offsets = numpy.concatenate([[0], numpy.cumsum(counts)])
+        template_ids = numpy.repeat(numpy.arange(len(query_images)), counts)
+        matcher_object = create_trained_matcher(algorithm, stacked_desc,
+                                                **filter_dict_keys(kwargs, MATCHER_PARAM_SPECS[algorithm].keys()))
+        timer.mark(f'{algorithm} matcher training', descriptors=len(stacked_desc))
+        k = min(MULTI_TEMPLATE_NEIGHBOURS, len(stacked_desc))
+        neighbours = matcher_object.knnMatch(base_desc, k=k)
+        timer.mark(f'{algorithm} matching')
+        per_template = split_neighbours(neighbours, k, template_ids, template_offsets)
+        timer.mark('Per template split')
+    return prepared_base, features, per_template
+
+
+def find_many(base_image, query_images: list, algorithm: str, color_space: str, detector: str, matching_method: str,
+              match_filters_by: str, prepared_base: dict = None, **kwargs):
+    settings = dict(kwargs, algorithm=algorithm, color_space=color_space, detector=detector,
+                    matching_method=matching_method, match_filters_by=match_filters_by)
+    if matching_method == MATCHING_METHOD_RADIUS:
+        # Radius matching has no neighbour count to share between templates, so they are matched one by one.
+        return [find(base_image, query_image, prepared_base=prepared_base, **settings) for query_image in query_images]
+    timer = Timer(f'{algorithm} multi-template find', base_size=list(base_image.shape), queries=len(query_images))
+    timer.start()
+    try:
+        prepared_base, features, per_template = _match_together(base_image, query_images, timer, algorithm,
+                                                                color_space, detector, prepared_base, **kwargs)
+    except:
+        # A failing shared index would fail every template at once, so they are left to fail (or not) one by one.
+        print_traceback(sys.exc_info())
+        timer.mark('Exception handling')
+        timer.stop()
+        return [find(base_image, query_image, prepared_base=prepared_base, **settings) for query_image in query_images]
+    shared_times = timer.stop()
+    del shared_times['total']
+    results = []
+    query_points = [get_keypoint_points(query_kp) for query_kp, _ in features]
+    for index, query_image in enumerate(query_images):
+        if per_template is None:
+            times, located = {}, {'matches': [], 'homography': None}
+        else:
+            match_arrays = dict(per_template[index],
+                                base_points=prepared_base['base_points'][per_template[index]['base_idx']],
+                                query_points=query_points[index][per_template[index]['query_idx']])
+            times, located = _find_in_template(query_image, algorithm, matching_method, match_filters_by,
+                                               match_arrays, **kwargs)
+            del times['total']
+        # Shared stages are split evenly between the templates, so that durations still add up across results.
+        duration = {**{stage: value / len(query_images) for stage, value in shared_times.items()}, **times}
+        duration['total'] = sum(duration.values())
+        results.append({'duration': duration, **located,
+                        'keypoints': {'base': len(prepared_base['base_kp']), 'query': len(features[index][0])}})
+    return results
+
+
+def split_neighbours(neighbours, k: int, template_ids, template_offsets):
+    # Neighbours are the base descriptors' matches, so queryIdx refers to the base and trainIdx to the stacked rows.
+    counts = numpy.fromiter((len(matches) for matches in neighbours), numpy.int64, len(neighbours))
+    total = int(counts.sum())
+    base_idx = numpy.repeat(numpy.arange(len(neighbours)), counts)
+    stacked_idx = numpy.fromiter((match.trainIdx for matches in neighbours for match in matches), numpy.int64, total)
+    distance = numpy.fromiter((match.distance for matches in neighbours for match in matches), numpy.float32, total)
+    # A template's second best match may not be among the k neighbours, but it cannot be closer than the k-th one.
+    bound = numpy.full(len(neighbours), numpy.inf, numpy.float32)
+    complete = counts == k
+    bound[complete] = distance[numpy.cumsum(counts)[complete] - 1]
+    template = template_ids[stacked_idx]
+    order = numpy.lexsort((distance, base_idx, template))
+    template, base_idx, stacked_idx, distance = template[order], base_idx[order], stacked_idx[order], distance[order]
+    # Each (template, base keypoint) group keeps its best match, and its second best distance for ratio tests.
+    starts = numpy.flatnonzero(numpy.concatenate([[total > 0], (template[1:] != template[:-1]) |
+                                                  (base_idx[1:] != base_idx[:-1])]))
+    sizes = numpy.diff(numpy.append(starts, total))
+    second_distance = numpy.where(sizes > 1, distance[numpy.minimum(starts + 1, total - 1)],
+                                  bound[base_idx[starts]])
+    template_starts = numpy.searchsorted(template[starts], numpy.arange(len(template_offsets)))
+    return [{
+        'base_idx': base_idx[starts[begin:end]].astype(numpy.int32),
+        'query_idx': (stacked_idx[starts[begin:end]] - template_offsets[index]).astype(numpy.int32),
+        'distance': distance[starts[begin:end]],
+        'second_distance': second_distance[begin:end],
+    } for index, (begin, end) in enumerate(zip(template_starts[:-1], template_starts[1:]))]
@@ -0,0 +1,47 @@
+import threading
+from collections import OrderedDict
+from .detectors import DETECTOR_PARAM_SPECS, create_detector
+from .matchers import MATCHER_PARAM_SPECS, create_trained_matcher, resolve_matcher
+from utils import filter_dict_keys
+
+
+# Trained matchers hold a copy of the base descriptors (and FLANN, its index), so only a few of them are kept around.
+MAX_TRAINED_MATCHERS = 4
+
+# OpenCV detectors and matchers are not meant to be used concurrently, so every thread gets its own pools.
+_thread_pools = threading.local()
+
+
+def _get_pool(name: str):
+    if not hasattr(_thread_pools, name):
+        setattr(_thread_pools, name, OrderedDict())
+    return getattr(_thread_pools, name)
+
+
+def clear_pools():
+    for name in list(vars(_thread_pools).keys()):
+        delattr(_thread_pools, name)
+
+
+def get_detector(detector: str, **kwargs):
+    detector_params = filter_dict_keys(kwargs, DETECTOR_PARAM_SPECS[detector].keys())
+    key = (detector, tuple(sorted(detector_params.items())))
+    detectors = _get_pool('detectors')
+    if key not in detectors:
+        detectors[key] = create_detector(detector, **detector_params)
+    return detectors[key]
+
+
+def get_trained_matcher(algorithm: str, base_key, base_desc, matching_method: str = None, **kwargs):
+    # Brute force (when FLANN cannot do the matching method) falls back to its default, Hamming distance, parameters.
+    algorithm = resolve_matcher(algorithm, matching_method, base_desc.dtype)
+    matcher_params = filter_dict_keys(kwargs, MATCHER_PARAM_SPECS[algorithm].keys())
+    key = (algorithm, tuple(sorted(matcher_params.items())), base_key)
+    matchers = _get_pool('matchers')
+    if key in matchers:
+        matchers.move_to_end(key)
+    else:
+        matchers[key] = create_trained_matcher(algorithm, base_desc, **matcher_params)
+        while len(matchers) > MAX_TRAINED_MATCHERS:
+            matchers.popitem(last=False)
+    return matchers[key]
@@ -0,0 +1,76 @@
+import cv2
+import numpy
+from image_filters.color_space import change_color_space_from_bgr
+from images import load_image
+
+
+REGION_PARAM_SPECS = {
+    'roi_x': {'type': int, 'min': 0, 'max': 20000, 'step': 1, 'nullable': True, 'default': None},
+    'roi_y': {'type': int, 'min': 0, 'max': 20000, 'step': 1, 'nullable': True, 'default': None},
+    'roi_width': {'type': int, 'min': 1, 'max': 20000, 'step': 1, 'nullable': True, 'default': None},
+    'roi_height': {'type': int, 'min': 1, 'max': 20000, 'step': 1, 'nullable': True, 'default': None},
+    # Binary image (non-zero meaning "searchable") of the same size as the base.
+    'roi_mask': {'type': str, 'nullable': True, 'default': None},
+}
+
+REGION_COLOR = (255, 128, 0)
+
+
+def crop_to_region(image, region: dict):
+    left, top, right, bottom = region['box']
+    # The whole image is kept as it is (not as a view), so that its cached hashes and conversions still apply.
+    return image if (left, top, right, bottom) == (0, 0, image.shape[1], image.shape[0]) else \
+        image[top:bottom, left:right]
+
+
+def fits_mask(mask, box: list[int]):
+    x, y, width, height = box
+    return mask is None or bool(mask[y:y + height, x:x + width].all())
+
+
+def get_fitting_windows(mask, window_size: tuple[int, int]):
+    # Windows (by their top left corner) with no masked out pixel under them, counted through an integral image.
+    ww, wh = window_size
+    outside = cv2.integral(numpy.uint8(mask == 0))
+    rh, rw = mask.shape[0] - wh + 1, mask.shape[1] - ww + 1
+    return (outside[wh:wh + rh, ww:ww + rw] - outside[0:rh, ww:ww + rw] - outside[wh:wh + rh, 0:rw] +
+            outside[0:rh, 0:rw]) == 0
+
+
+def get_full_working_image(base_image, working_base_image, color_space: str):
+    # Only plots need the whole base, even if just a region of it was searched.
+    return working_base_image if working_base_image.shape[:2] == base_image.shape[:2] else \
+        change_color_space_from_bgr(color_space, [base_image])[0]
+
+
+def get_region(base_shape: tuple, roi_x: int = None, roi_y: int = None, roi_width: int = None,
+               roi_height: int = None, roi_mask: str = None, region_offset: tuple[int, int] = (0, 0), **kwargs):
+    # Region coordinates (and masks) refer to the full base, of which base_shape may be a part at region_offset (e.g.
+    # a tile). The resulting box is relative to that part, and the mask is cropped to the box.
+    bh, bw = base_shape[:2]
+    ox, oy = region_offset
+    x, y = roi_x or 0, roi_y or 0
+    left, top = max(x - ox, 0), max(y - oy, 0)
+    right = bw if roi_width is None else min(x + roi_width - ox, bw)
+    bottom = bh if roi_height is None else min(y + roi_height - oy, bh)
+    mask = None
+    if roi_mask is not None and right > left and bottom > top:
+        full_mask = load_image(roi_mask)
+        if full_mask.shape[0] < oy + bh or full_mask.shape[1] < ox + bw:
+            raise Exception(f'Region mask {roi_mask} does not cover the whole base image.')
+        mask = full_mask[oy + top:oy + bottom, ox + left:ox + right]
+        mask = numpy.uint8((mask.max(axis=2) if len(mask.shape) > 2 else mask) > 0) * 255
+        # Only the bounding box of the mask is searched at all.
+        mx, my, mw, mh = cv2.boundingRect(mask)
+        left, top, right, bottom = left + mx, top + my, left + mx + mw, top + my + mh
+        mask = mask[my:my + mh, mx:mx + mw]
+    if right <= left or bottom <= top:
+        raise Exception('The region of interest does not overlap the base image (or its mask is empty).')
+    return {'box': (left, top, right, bottom), 'mask': mask}
+
+
+def plot_region(plot_image, base_shape: tuple, region: dict):
+    left, top, right, bottom = region['box']
+    if (left, top, right, bottom) != (0, 0, base_shape[1], base_shape[0]):
+        cv2.rectangle(plot_image, (left, top), (right - 1, bottom - 1), REGION_COLOR, 2)
+    return plot_image
@@ -1,11 +1,15 @@
 from image_filters.color_space import COLOR_PARAM_SPECS
-from .matcher import ALGORITHM, METHODS, plot
+from .fft import ENGINE_AUTO, ENGINE_FFT, ENGINE_PARAM_SPECS, ENGINE_SPATIAL
+from .matcher import ALGORITHM, METHODS, find, plot, prepare
+from .pyramid import SEARCH_EXHAUSTIVE, SEARCH_MODE_PARAM_SPECS, SEARCH_PYRAMID
+from algorithms.region import REGION_PARAM_SPECS
 
 
 PARAMETER_SPECS = {
     'algorithms': [ALGORITHM],
     'parameters': [
         {'': {'all': COLOR_PARAM_SPECS}},
+        {'': {'all': REGION_PARAM_SPECS}},
         {'': {'all': {
             'method': {
                 'type': str,
@@ -13,6 +17,8 @@ PARAMETER_SPECS = {
                 'default': 'TM_SQDIFF_NORMED',
             },
             'filter_by': {'type': str, 'options': ['number', 'ratio'], 'default': 'number'},
+            'search_mode': {'type': str, 'options': [SEARCH_EXHAUSTIVE, SEARCH_PYRAMID], 'default': SEARCH_EXHAUSTIVE},
+            'engine': {'type': str, 'options': [ENGINE_AUTO, ENGINE_FFT, ENGINE_SPATIAL], 'default': ENGINE_SPATIAL},
         }}},
         {'filter_by': {
             'number': {
@@ -22,8 +28,20 @@ PARAMETER_SPECS = {
                 'match_ratio_threshold': {'type': float, 'min': 0.01, 'max': 1.0, 'step': 0.01, 'default': 0.5},
             },
         }},
+        {'search_mode': SEARCH_MODE_PARAM_SPECS},
+        {'engine': ENGINE_PARAM_SPECS},
     ],
+    'find_functions': {
+        ALGORITHM: find,
+    },
+    'find_many_functions': {
+        # No single-pass search for several templates (they are searched one by one).
+        ALGORITHM: None,
+    },
     'plot_functions': {
         ALGORITHM: plot,
     },
+    'prepare_functions': {
+        ALGORITHM: prepare,
+    },
 }
@@ -0,0 +1,145 @@
+import cv2
+import numpy
+import time
+from caching import LRUCache, MEGABYTE, hash_image, register_cache
+
+
+ENGINE_AUTO = 'auto'
+ENGINE_FFT = 'fft'
+ENGINE_SPATIAL = 'spatial'
+
+ENGINE_PARAM_SPECS = {
+    ENGINE_AUTO: {
+        # From benchmark.py --engines: on the corpus base, the FFT engine was faster (for every method) from 8x8
+        # templates on.
+        'fft_min_template_pixels': {'type': int, 'min': 0, 'max': 100000, 'step': 100, 'default': 100},
+    },
+    ENGINE_FFT: {
+        # No parameters needed for this engine.
+    },
+    ENGINE_SPATIAL: {
+        # No parameters needed for this engine.
+    },
+}
+
+# For calls that do not go through the configuration (i.e. whose settings were not filled in from the specs).
+FFT_MIN_TEMPLATE_PIXELS = ENGINE_PARAM_SPECS[ENGINE_AUTO]['fft_min_template_pixels']['default']
+
+BASE_STATISTICS_CACHE = register_cache('base_statistics', LRUCache(512 * MEGABYTE))
+
+
+def _normalize(numerator, denominator, is_sqdiff: bool):
+    # Same handling as OpenCV's for windows whose norm is (numerically) zero.
+    within = numpy.abs(numerator) < denominator
+    result = numpy.divide(numerator, denominator, out=numpy.zeros_like(numerator), where=within)
+    outside = ~within
+    if outside.any():
+        result[outside] = numpy.where(numpy.abs(numerator[outside]) < denominator[outside] * 1.125,
+                                      numpy.sign(numerator[outside]), 1.0 if is_sqdiff else 0.0)
+    return result
+
+
+def _pad(channel, padded_shape: tuple[int, int]):
+    padded = numpy.zeros(padded_shape, numpy.float32)
+    padded[:channel.shape[0], :channel.shape[1]] = channel
+    return padded
+
+
+def _split_channels(image):
+    return [image] if len(image.shape) == 2 else cv2.split(image)
+
+
+def _window_sums(integral, qh: int, qw: int, rh: int, rw: int):
+    sums = integral[qh:qh + rh, qw:qw + rw] - integral[0:rh, qw:qw + rw]
+    sums -= integral[qh:qh + rh, 0:rw]
+    sums += integral[0:rh, 0:rw]
+    return sums
+
+
+def benchmark_engines(base_image, template_sizes: list[int], method_enums: dict, repeats: int = 3):
+    results = []
+    cv2.matchTemplate(base_image, base_image[:1, :1], cv2.TM_CCORR)
+    get_base_statistics(base_image)
+    for size in template_sizes:
+        query_image = base_image[:size, :size].copy()
+        for method_name, method_enum in method_enums.items():
+            timings = {}
+            for engine, function in [(ENGINE_SPATIAL, cv2.matchTemplate), (ENGINE_FFT, match_template_fft)]:
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    function(base_image, query_image, method_enum)
+                timings[engine] = (time.perf_counter() - start) / repeats
+            results.append({'template_size': size, 'method': method_name, **timings})
+    return results
+
+
+def get_base_statistics(base_image):
+    # Only the valid part of the correlation is needed, so the base does not need to be padded by the template size,
+    # and a single spectrum serves every template. Spectra are computed over zero-mean channels, which keeps float32
+    # rounding errors relative to the image contrast instead of its brightness.
+    key = hash_image(base_image)
+    statistics = BASE_STATISTICS_CACHE.get(key)
+    if statistics is None:
+        bh, bw = base_image.shape[:2]
+        padded_shape = (cv2.getOptimalDFTSize(bh), cv2.getOptimalDFTSize(bw))
+        spectra, sums, squared_sums = [], [], []
+        for channel in _split_channels(base_image):
+            spectra.append(cv2.dft(_pad(channel - float(numpy.mean(channel)), padded_shape)))
+            channel_sum, channel_squared_sum = cv2.integral2(channel, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+            sums.append(channel_sum)
+            squared_sums.append(channel_squared_sum)
+        statistics = {'padded_shape': padded_shape, 'spectra': spectra, 'sums': sums,
+                      'squared_sums': numpy.sum(squared_sums, axis=0)}
+        size = sum(array.nbytes for array in spectra + sums) + statistics['squared_sums'].nbytes
+        BASE_STATISTICS_CACHE.put(key, statistics, size)
+    return statistics
+
+
+def match_template(base_image, query_image, method_enum: int, engine: str = ENGINE_SPATIAL,
+                   fft_min_template_pixels: int = FFT_MIN_TEMPLATE_PIXELS, base_statistics: dict = None, **kwargs):
+    qh, qw = query_image.shape[:2]
+    return match_template_fft(base_image, query_image, method_enum, base_statistics) \
+        if uses_fft(base_image, engine, qh * qw, fft_min_template_pixels) \
+        else cv2.matchTemplate(base_image, query_image, method_enum)
+
+
+def match_template_fft(base_image, query_image, method_enum: int, base_statistics: dict = None):
+    bh, bw = base_image.shape[:2]
+    qh, qw = query_image.shape[:2]
+    rh, rw = bh - qh + 1, bw - qw + 1
+    statistics = get_base_statistics(base_image) if base_statistics is None else base_statistics
+    query_channels = [channel.astype(numpy.float64) for channel in _split_channels(query_image)]
+    query_means = [float(numpy.mean(channel)) for channel in query_channels]
+    spectrum = None
+    for base_spectrum, query_channel, query_mean in zip(statistics['spectra'], query_channels, query_means):
+        query_spectrum = cv2.dft(_pad(query_channel - query_mean, statistics['padded_shape']))
+        product = cv2.mulSpectrums(base_spectrum, query_spectrum, 0, conjB=True)
+        spectrum = product if spectrum is None else spectrum + product
+    # With both sides being zero-mean, this is already TM_CCOEFF.
+    result = cv2.idft(spectrum, flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)[:rh, :rw].astype(numpy.float64)
+    if method_enum == cv2.TM_CCOEFF:
+        return result.astype(numpy.float32)
+    base_sums = [_window_sums(channel_sums, qh, qw, rh, rw) for channel_sums in statistics['sums']]
+    base_squared_sums = _window_sums(statistics['squared_sums'], qh, qw, rh, rw)
+    query_squared_sum = sum(float(numpy.sum(channel * channel)) for channel in query_channels)
+    if method_enum == cv2.TM_CCOEFF_NORMED:
+        area = qh * qw
+        base_variances = base_squared_sums - sum(sums * sums for sums in base_sums) / area
+        query_variance = query_squared_sum - sum(mean * mean for mean in query_means) * area
+        result = _normalize(result, numpy.sqrt(numpy.maximum(base_variances, 0) * max(query_variance, 0)), False)
+        return result.astype(numpy.float32)
+    for query_mean, sums in zip(query_means, base_sums):
+        result += query_mean * sums
+    if method_enum in [cv2.TM_SQDIFF, cv2.TM_SQDIFF_NORMED]:
+        result = base_squared_sums - 2 * result + query_squared_sum
+    if method_enum in [cv2.TM_CCORR_NORMED, cv2.TM_SQDIFF_NORMED]:
+        result = _normalize(result, numpy.sqrt(base_squared_sums * query_squared_sum),
+                            method_enum == cv2.TM_SQDIFF_NORMED)
+    return result.astype(numpy.float32)
+
+
+def uses_fft(base_image, engine: str, template_pixels: int, fft_min_template_pixels: int = FFT_MIN_TEMPLATE_PIXELS):
+    # OpenCV's own (tiled DFT) implementation was faster than a whole-image FFT on single-channel images in every
+    # benchmark, so "auto" only picks the FFT for multichannel ones.
+    return engine == ENGINE_FFT or (engine == ENGINE_AUTO and len(base_image.shape) > 2 and
+                                    template_pixels >= fft_min_template_pixels)
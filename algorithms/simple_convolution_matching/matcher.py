@@ -1,6 +1,11 @@
 import cv2
 import numpy
 import sys
+from .fft import ENGINE_SPATIAL, get_base_statistics, match_template, uses_fft
+from .peaks import MAX_PEAKS, find_peaks, get_ratio_threshold
+from .pyramid import PYRAMID_DEFAULTS, SEARCH_EXHAUSTIVE, SEARCH_PYRAMID, build_pyramid, search_pyramid
+from algorithms.region import crop_to_region, fits_mask, get_fitting_windows, get_full_working_image, get_region, \
+    plot_region
 from image_filters.color_space import change_color_space_from_bgr, COLOR_BW
 from timer import Timer
 from utils import plot_empty_match, print_traceback
@@ -8,16 +13,30 @@ from utils import plot_empty_match, print_traceback
 
 ALGORITHM = 'Match Template'
 
+# Scores are reported as "offset - mult * value", so that higher is always better (and normalized methods stay within
+# [-1, 1]).
 METHODS = {
-    'TM_CCOEFF': {'enum': cv2.TM_CCOEFF, 'mult': -1},
-    'TM_CCOEFF_NORMED': {'enum': cv2.TM_CCOEFF_NORMED, 'mult': -1},
-    'TM_CCORR': {'enum': cv2.TM_CCORR, 'mult': -1},
-    'TM_CCORR_NORMED': {'enum': cv2.TM_CCORR_NORMED, 'mult': -1},
-    'TM_SQDIFF': {'enum': cv2.TM_SQDIFF, 'mult': 1},
-    'TM_SQDIFF_NORMED': {'enum': cv2.TM_SQDIFF_NORMED, 'mult': 1},
+    'TM_CCOEFF': {'enum': cv2.TM_CCOEFF, 'mult': -1, 'offset': 0},
+    'TM_CCOEFF_NORMED': {'enum': cv2.TM_CCOEFF_NORMED, 'mult': -1, 'offset': 0},
+    'TM_CCORR': {'enum': cv2.TM_CCORR, 'mult': -1, 'offset': 0},
+    'TM_CCORR_NORMED': {'enum': cv2.TM_CCORR_NORMED, 'mult': -1, 'offset': 0},
+    'TM_SQDIFF': {'enum': cv2.TM_SQDIFF, 'mult': 1, 'offset': 0},
+    'TM_SQDIFF_NORMED': {'enum': cv2.TM_SQDIFF_NORMED, 'mult': 1, 'offset': 1},
 }
 
 
+def find(base_image, query_image, algorithm: str, **kwargs):
+    matches = []
+    timer = Timer(f'{algorithm} find', base_size=list(base_image.shape), query_size=list(query_image.shape))
+    timer.start()
+    try:
+        _, _, matches, _ = match(base_image, query_image, timer, **kwargs)
+    except:
+        print_traceback(sys.exc_info())
+        timer.mark('Exception handling')
+    return {'duration': timer.stop(), 'matches': matches}
+
+
 def generate_plot(base_image, query_image, color_space, matches):
     bh, bw = base_image.shape[:2]
     qh, qw = query_image.shape[:2]
@@ -28,49 +47,103 @@ def generate_plot(base_image, query_image, color_space, matches):
     if color_space == COLOR_BW:
         plot_image = cv2.cvtColor(plot_image, cv2.COLOR_GRAY2BGR)
     for match in matches:
-        location = match[0]
-        value = match[1]
-        bottom_right = (location[0] + qw, location[1] + qh)
-        cv2.rectangle(plot_image, location, bottom_right, (0, int(value), 255 - int(value)), 5)
+        x, y, width, height = match['box']
+        value = int(255 * min(max(match['score'], 0.0), 1.0))
+        cv2.rectangle(plot_image, (x, y), (x + width, y + height), (0, value, 255 - value), 5)
     return plot_image
 
 
-def plot(base_image, query_image, algorithm: str, color_space: str, method: str, filter_by: str = None,
-         n_matches: int = None, match_ratio_threshold: float = None):
-    sorted_matches = []
-    top_results = []
-    timer = Timer()
+def match(base_image, query_image, timer: Timer, color_space: str, method: str, filter_by: str = None,
+          n_matches: int = 1, match_ratio_threshold: float = None, search_mode: str = SEARCH_EXHAUSTIVE,
+          prepared_base: dict = None, **kwargs):
+    if prepared_base is None:
+        prepared_base = prepare(base_image, ALGORITHM, color_space, search_mode=search_mode, **kwargs)
+        timer.mark('Base preparation')
+    working_base_image, region = prepared_base['working_base_image'], prepared_base['region']
+    working_query_image = change_color_space_from_bgr(color_space, [query_image])[0]
+    timer.mark(f'Query color space change ({color_space})')
+    lower_is_better = METHODS[method]['mult'] > 0
+    if search_mode == SEARCH_PYRAMID:
+        found = search_pyramid(prepared_base['base_pyramid'], working_query_image, METHODS[method]['enum'],
+                               lower_is_better, n_matches, match_ratio_threshold if filter_by == 'ratio' else None,
+                               **kwargs)
+        # Pyramid levels are searched unmasked, so candidates falling off the mask are only dropped at the end.
+        found = [candidate for candidate in found if fits_mask(region['mask'], candidate[:4])]
+        timer.mark('Pyramid search', candidates=len(found))
+    else:
+        found = search_exhaustive(working_base_image, working_query_image, timer, METHODS[method]['enum'],
+                                  lower_is_better, filter_by, n_matches, match_ratio_threshold, region['mask'],
+                                  base_statistics=prepared_base.get('base_statistics'), **kwargs)
+    # Boxes are found on the region, and moved back onto the whole base.
+    left, top = region['box'][:2]
+    matches = [{'box': [x + left, y + top, width, height], 'score': score(method, value)}
+               for x, y, width, height, value in found]
+    return working_base_image, working_query_image, matches, region
+
+
+def plot(base_image, query_image, algorithm: str, color_space: str, **kwargs):
+    matches = []
+    timer = Timer(f'{algorithm} plot', base_size=list(base_image.shape), query_size=list(query_image.shape))
     timer.start()
     try:
-        working_base_image, working_query_image = change_color_space_from_bgr(color_space, [base_image, query_image])
-        timer.mark(f'Color space change ({color_space})')
-        match_result = cv2.matchTemplate(working_base_image, working_query_image, METHODS[method]['enum'])
-        timer.mark('Convolution')
-        if filter_by == 'number' and n_matches == 1:
-            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(match_result)
-            sorted_matches = [[min_loc, min_val], [max_loc, max_val]]
-        else:
-            bw = working_base_image.shape[1]
-            zipped_matches = [[(i // bw, i % bw), value] for i, value in enumerate(numpy.array(match_result).flatten())]
-            sorted_matches = sorted(zipped_matches, key=lambda match: match[1])
-        timer.mark('Match sorting')
-        if METHODS[method]['mult'] > 0:
-            sorted_matches = [[match[0], 255 - match[1]] for match in sorted_matches]
-        else:
-            sorted_matches = sorted_matches[::-1]
-        timer.mark('Match adjustment')
-        if filter_by == 'ratio':
-            lbound = 255 * match_ratio_threshold
-            top_results = [match for match in sorted_matches if match[1] >= lbound]
-        timer.mark('Match rating')
-        if n_matches is not None and len(top_results) < n_matches:
-            top_results = sorted_matches[:n_matches]
-        timer.mark('Match selection')
-        matches_image = generate_plot(working_base_image, working_query_image, color_space, top_results)
+        working_base_image, working_query_image, matches, region = match(base_image, query_image, timer,
+                                                                         color_space, **kwargs)
+        matches_image = generate_plot(get_full_working_image(base_image, working_base_image, color_space),
+                                      working_query_image, color_space, matches)
+        matches_image = plot_region(matches_image, base_image.shape, region)
         timer.mark('Plotting')
     except:
         print_traceback(sys.exc_info())
         timer.mark('Exception handling')
         matches_image = plot_empty_match(base_image, query_image)
         timer.mark('Empty matches image creation')
-    return {'duration': timer.stop(), 'image': matches_image}
+    return {'duration': timer.stop(), 'image': matches_image, 'matches': matches}
+
+
+def prepare(base_image, algorithm: str, color_space: str, search_mode: str = SEARCH_EXHAUSTIVE,
+            pyramid_levels: int = PYRAMID_DEFAULTS['pyramid_levels'], engine: str = ENGINE_SPATIAL, **kwargs):
+    # Only the region of interest is converted, searched (and its pyramid or FFT statistics computed).
+    region = get_region(base_image.shape, **kwargs)
+    working_base_image = change_color_space_from_bgr(color_space, [crop_to_region(base_image, region)])[0]
+    prepared_base = {'working_base_image': working_base_image, 'region': region}
+    if search_mode == SEARCH_PYRAMID:
+        prepared_base['base_pyramid'] = build_pyramid(working_base_image, pyramid_levels)
+    elif uses_fft(working_base_image, engine, sys.maxsize, 0):
+        # Kept along with the prepared base too, so that the templates of a batch share them even when they do not fit
+        # in the base_statistics cache (e.g. for very large bases).
+        prepared_base['base_statistics'] = get_base_statistics(working_base_image)
+    return prepared_base
+
+
+def score(method: str, value: float):
+    return float(METHODS[method]['offset'] - METHODS[method]['mult'] * value)
+
+
+def search_exhaustive(base_image, query_image, timer: Timer, method_enum: int, lower_is_better: bool, filter_by: str,
+                      n_matches: int, match_ratio_threshold: float, mask=None, **kwargs):
+    match_result = match_template(base_image, query_image, method_enum, **kwargs)
+    timer.mark('Convolution', response_size=list(match_result.shape))
+    qh, qw = query_image.shape[:2]
+    if mask is not None:
+        # Positions where the template would not lie entirely on the mask get the worst response there is.
+        fitting = get_fitting_windows(mask, (qw, qh))
+        if not fitting.any():
+            timer.mark('Masking', positions=0)
+            return []
+        match_result[~fitting] = match_result.max() if lower_is_better else match_result.min()
+        timer.mark('Masking', positions=int(fitting.sum()))
+    if filter_by == 'number' and n_matches == 1:
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(match_result)
+        (x, y), value = (min_loc, min_val) if lower_is_better else (max_loc, max_val)
+        xs, ys, values = [x], [y], [value]
+    else:
+        threshold = None
+        if filter_by == 'ratio':
+            min_val, max_val, _, _ = cv2.minMaxLoc(match_result)
+            threshold = get_ratio_threshold(min_val, max_val, match_ratio_threshold, lower_is_better)
+        xs, ys, values = find_peaks(match_result, MAX_PEAKS if filter_by == 'ratio' else n_matches, (qw, qh),
+                                    lower_is_better, threshold)
+        if n_matches is not None and len(values) < n_matches:
+            xs, ys, values = find_peaks(match_result, n_matches, (qw, qh), lower_is_better)
+    timer.mark('Peak extraction', peaks=len(values))
+    return [(int(x), int(y), qw, qh, value) for x, y, value in zip(xs, ys, values)]
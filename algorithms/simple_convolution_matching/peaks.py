@@ -0,0 +1,60 @@
+import cv2
+import numpy
+
+
+# The response map is scanned in horizontal bands of about this size, so that the extra memory needed on top of the
+# response map itself does not depend on the size of the base image.
+BAND_BYTES = 32 * 1024 * 1024
+# Candidates kept per band (and per requested peak) before suppression.
+CANDIDATES_PER_PEAK = 8
+MAX_PEAKS = 1000
+
+
+def find_peaks(response, n_peaks: int, suppression_size: tuple[int, int], lower_is_better: bool = False,
+               threshold: float = None):
+    rh, rw = response.shape[:2]
+    sw, sh = suppression_size
+    radius = (max(sh // 2, 1), max(sw // 2, 1))
+    kernel = numpy.ones((2 * radius[0] + 1, 2 * radius[1] + 1), numpy.uint8)
+    band_rows = max(1, BAND_BYTES // (rw * response.itemsize))
+    band_results = []
+    for top in range(0, rh, band_rows):
+        bottom = min(top + band_rows, rh)
+        lo = max(top - radius[0], 0)
+        hi = min(bottom + radius[0], rh)
+        band = -response[lo:hi] if lower_is_better else response[lo:hi]
+        dilated = cv2.dilate(band, kernel)
+        inner = slice(top - lo, bottom - lo)
+        is_peak = band[inner] >= dilated[inner]
+        if threshold is not None:
+            is_peak &= band[inner] >= (-threshold if lower_is_better else threshold)
+        ys, xs = numpy.nonzero(is_peak)
+        if len(ys) > 0:
+            values = band[inner][ys, xs]
+            kept = suppress_peaks(values, ys, xs, n_peaks, radius)
+            band_results.append((values[kept], ys[kept] + top, xs[kept]))
+    if len(band_results) == 0:
+        return numpy.empty(0, numpy.intp), numpy.empty(0, numpy.intp), numpy.empty(0, response.dtype)
+    values, ys, xs = [numpy.concatenate(arrays) for arrays in zip(*band_results)]
+    kept = suppress_peaks(values, ys, xs, n_peaks, radius)
+    return xs[kept], ys[kept], -values[kept] if lower_is_better else values[kept]
+
+
+def get_ratio_threshold(min_val: float, max_val: float, match_ratio_threshold: float, lower_is_better: bool):
+    return max_val - match_ratio_threshold * (max_val - min_val) if lower_is_better else \
+        min_val + match_ratio_threshold * (max_val - min_val)
+
+
+def suppress_peaks(values, ys, xs, n_peaks: int, radius: tuple[int, int]):
+    ry, rx = radius
+    candidates = numpy.arange(len(values))
+    if len(values) > n_peaks * CANDIDATES_PER_PEAK:
+        candidates = numpy.argpartition(values, -n_peaks * CANDIDATES_PER_PEAK)[-n_peaks * CANDIDATES_PER_PEAK:]
+    candidates = candidates[numpy.argsort(values[candidates], kind='stable')[::-1]]
+    kept = []
+    while candidates.size > 0 and len(kept) < n_peaks:
+        best = candidates[0]
+        kept.append(best)
+        candidates = candidates[(numpy.abs(ys[candidates] - ys[best]) > ry) |
+                                (numpy.abs(xs[candidates] - xs[best]) > rx)]
+    return numpy.array(kept, numpy.intp)
@@ -0,0 +1,104 @@
+import cv2
+import numpy
+from .peaks import MAX_PEAKS, find_peaks, get_ratio_threshold, suppress_peaks
+
+
+SEARCH_EXHAUSTIVE = 'exhaustive'
+SEARCH_PYRAMID = 'pyramid'
+
+# Coarser levels are not used once the template would get smaller than this (in pixels).
+MIN_TEMPLATE_SIZE = 8
+
+SEARCH_MODE_PARAM_SPECS = {
+    SEARCH_EXHAUSTIVE: {
+        # No parameters needed for this search mode.
+    },
+    SEARCH_PYRAMID: {
+        'pyramid_levels': {'type': int, 'min': 1, 'max': 8, 'step': 1, 'default': 3},
+        'pyramid_candidates': {'type': int, 'min': 1, 'max': 100, 'step': 1, 'default': 10},
+        'refinement_window': {'type': int, 'min': 1, 'max': 32, 'step': 1, 'default': 3},
+        'min_template_scale': {'type': float, 'min': 0.1, 'max': 4.0, 'step': 0.05, 'default': 1.0},
+        'max_template_scale': {'type': float, 'min': 0.1, 'max': 4.0, 'step': 0.05, 'default': 1.0},
+        'template_scale_steps': {'type': int, 'min': 1, 'max': 50, 'step': 1, 'default': 1},
+    },
+}
+# For calls that do not go through the configuration (i.e. whose settings were not filled in from the specs).
+PYRAMID_DEFAULTS = {name: spec['default'] for name, spec in SEARCH_MODE_PARAM_SPECS[SEARCH_PYRAMID].items()}
+
+
+def build_pyramid(image, levels: int):
+    pyramid = [image]
+    for _ in range(1, levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def get_template_scales(min_template_scale: float, max_template_scale: float, template_scale_steps: int):
+    return numpy.linspace(min_template_scale, max_template_scale, template_scale_steps) if template_scale_steps > 1 \
+        else [min_template_scale]
+
+
+def refine(base_image, query_image, method_enum: int, lower_is_better: bool, x: int, y: int, window: int):
+    bh, bw = base_image.shape[:2]
+    qh, qw = query_image.shape[:2]
+    left, right = min(max(x - window, 0), bw - qw), min(max(x + window, 0), bw - qw)
+    top, bottom = min(max(y - window, 0), bh - qh), min(max(y + window, 0), bh - qh)
+    response = cv2.matchTemplate(base_image[top:bottom + qh, left:right + qw], query_image, method_enum)
+    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(response)
+    (rx, ry), value = (min_loc, min_val) if lower_is_better else (max_loc, max_val)
+    return left + rx, top + ry, value
+
+
+def search_pyramid(base_pyramid, query_image, method_enum: int, lower_is_better: bool, n_matches: int,
+                   match_ratio_threshold: float,
+                   pyramid_candidates: int = PYRAMID_DEFAULTS['pyramid_candidates'],
+                   refinement_window: int = PYRAMID_DEFAULTS['refinement_window'],
+                   min_template_scale: float = PYRAMID_DEFAULTS['min_template_scale'],
+                   max_template_scale: float = PYRAMID_DEFAULTS['max_template_scale'],
+                   template_scale_steps: int = PYRAMID_DEFAULTS['template_scale_steps'], **kwargs):
+    bh, bw = base_pyramid[0].shape[:2]
+    found = []
+    for scale in get_template_scales(min_template_scale, max_template_scale, template_scale_steps):
+        qh, qw = query_image.shape[:2]
+        qh, qw = int(round(qh * scale)), int(round(qw * scale))
+        if qh < 1 or qw < 1 or qh > bh or qw > bw:
+            continue
+        scaled_query_image = query_image if scale == 1.0 else cv2.resize(query_image, (qw, qh))
+        found.append(search_scale(base_pyramid, scaled_query_image, method_enum, lower_is_better,
+                                  max(pyramid_candidates, n_matches or 1), refinement_window, match_ratio_threshold))
+    if len(found) == 0:
+        return []
+    xs, ys, values, widths, heights, passes = [numpy.concatenate(arrays) for arrays in zip(*found)]
+    # Duplicates (from different candidates or scales converging on the same spot) are suppressed by the size of the
+    # smallest template.
+    radius = (max(int(heights.min()) // 2, 1), max(int(widths.min()) // 2, 1))
+    oriented = -values if lower_is_better else values
+    candidates = numpy.flatnonzero(passes)
+    kept = candidates[suppress_peaks(oriented[candidates], ys[candidates], xs[candidates],
+                                     MAX_PEAKS if match_ratio_threshold is not None else n_matches, radius)]
+    if n_matches is not None and len(kept) < n_matches:
+        kept = suppress_peaks(oriented, ys, xs, n_matches, radius)
+    return [(int(xs[i]), int(ys[i]), int(widths[i]), int(heights[i]), float(values[i])) for i in kept]
+
+
+def search_scale(base_pyramid, query_image, method_enum: int, lower_is_better: bool, n_candidates: int,
+                 refinement_window: int, match_ratio_threshold: float = None):
+    query_pyramid = [query_image]
+    while len(query_pyramid) < len(base_pyramid) and min(query_pyramid[-1].shape[:2]) >= 2 * MIN_TEMPLATE_SIZE:
+        query_pyramid.append(cv2.pyrDown(query_pyramid[-1]))
+    top = len(query_pyramid) - 1
+    response = cv2.matchTemplate(base_pyramid[top], query_pyramid[top], method_enum)
+    qh, qw = query_pyramid[top].shape[:2]
+    xs, ys, values = find_peaks(response, n_candidates, (qw, qh), lower_is_better)
+    for level in range(top - 1, -1, -1):
+        refined = [refine(base_pyramid[level], query_pyramid[level], method_enum, lower_is_better, 2 * x, 2 * y,
+                          refinement_window) for x, y in zip(xs, ys)]
+        xs, ys, values = [numpy.array(column) for column in zip(*refined)]
+    passes = numpy.ones(len(values), bool)
+    if match_ratio_threshold is not None:
+        # Only the coarsest response is fully known, so its range approximates the one of the full resolution.
+        min_val, max_val, _, _ = cv2.minMaxLoc(response)
+        threshold = get_ratio_threshold(min_val, max_val, match_ratio_threshold, lower_is_better)
+        passes = values <= threshold if lower_is_better else values >= threshold
+    qh, qw = query_image.shape[:2]
+    return xs, ys, values, numpy.full(len(values), qw), numpy.full(len(values), qh), passes
@@ -0,0 +1,88 @@
+import math
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+from .region import crop_to_region, get_region
+from timer import Timer
+
+
+# Matches from neighbouring tiles overlapping by more than this (intersection over union) are considered the same one.
+SEAM_IOU_THRESHOLD = 0.5
+
+
+def _offset_match(match: dict, x: int, y: int):
+    offset = dict(match, box=[match['box'][0] + x, match['box'][1] + y, *match['box'][2:]])
+    if 'outline' in match:
+        offset['outline'] = [[px + x, py + y] for px, py in match['outline']]
+    return offset
+
+
+def _tile_starts(length: int, tile_size: int, step: int):
+    starts = list(range(0, max(length - tile_size, 0) + 1, step))
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
+    return starts
+
+
+def find_tiled(find_function, base_image, query_image, algorithm: str, tile_size: int, threads: int = None,
+               **kwargs):
+    timer = Timer(f'{algorithm} tiled find', base_size=list(base_image.shape), query_size=list(query_image.shape))
+    timer.start()
+    # Only the region of interest is tiled. Tiles are entirely within it, so they only need to know where they are
+    # (e.g. to crop the region mask), and tiles falling off the mask are not searched at all.
+    region = get_region(base_image.shape, **kwargs)
+    region_left, region_top = region['box'][:2]
+    region_image = crop_to_region(base_image, region)
+    tiles = [(left + region_left, top + region_top, right + region_left, bottom + region_top)
+             for left, top, right, bottom in get_tiles(region_image.shape, query_image.shape, tile_size,
+                                                       kwargs.get('max_template_scale', 1.0))
+             if region['mask'] is None or region['mask'][top:bottom, left:right].any()]
+    kwargs = dict(kwargs, roi_x=None, roi_y=None, roi_width=None, roi_height=None)
+
+    def find_in_tile(tile: tuple[int, int, int, int]):
+        left, top, right, bottom = tile
+        with timer.span('Tile', box=[left, top, right - left, bottom - top]):
+            return find_function(base_image[top:bottom, left:right], query_image, algorithm,
+                                 region_offset=(left, top), **kwargs)
+
+    # Tiles are views on the base, so (for memory-mapped bases) only the ones being searched are actually in memory.
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        found = list(executor.map(find_in_tile, tiles))
+    timer.mark('Tiled search', tiles=len(tiles))
+    matches = [_offset_match(match, left, top) for (left, top, _, _), result in zip(tiles, found)
+               for match in result['matches']]
+    matches = merge_seam_duplicates(matches)
+    if kwargs.get('filter_by') == 'number' and kwargs.get('n_matches') is not None:
+        matches = matches[:kwargs['n_matches']]
+    timer.mark('Seam merging')
+    return {'duration': timer.stop(), 'matches': matches, 'tiles': len(tiles)}
+
+
+def get_tiles(base_shape: tuple, query_shape: tuple, tile_size: int, max_template_scale: float = 1.0):
+    bh, bw = base_shape[:2]
+    # Every possible match location is fully contained in at least one tile if they overlap by the template size.
+    overlap = math.ceil(max(query_shape[:2]) * max(max_template_scale, 1.0))
+    if tile_size <= overlap:
+        raise Exception(f'Tile size {tile_size} must be larger than the (scaled) template size {overlap}.')
+    step = tile_size - overlap
+    return [(left, top, min(left + tile_size, bw), min(top + tile_size, bh))
+            for top in _tile_starts(bh, tile_size, step) for left in _tile_starts(bw, tile_size, step)]
+
+
+def merge_seam_duplicates(matches: list[dict]):
+    if len(matches) == 0:
+        return matches
+    boxes = numpy.array([match['box'] for match in matches], numpy.float64)
+    order = numpy.argsort([-match['score'] for match in matches], kind='stable')
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+    kept = []
+    while order.size > 0:
+        best = order[0]
+        kept.append(best)
+        rest = order[1:]
+        intersections = numpy.clip(numpy.minimum(x2[best], x2[rest]) - numpy.maximum(x1[best], x1[rest]), 0, None) * \
+            numpy.clip(numpy.minimum(y2[best], y2[rest]) - numpy.maximum(y1[best], y1[rest]), 0, None)
+        ious = intersections / numpy.maximum(areas[best] + areas[rest] - intersections, 1e-9)
+        order = rest[ious <= SEAM_IOU_THRESHOLD]
+    return [matches[i] for i in kept]
@@ -0,0 +1,137 @@
+import csv
+import cv2
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from algorithms import PARAMETER_SPECS
+from algorithms.feature_matching.library import TemplateLibrary
+from algorithms.tiling import find_tiled
+from caching import configure_caches
+from images import load_image, set_disk_cache_directory
+from timer import Timer, drain_trace_events, enable_tracing, write_chrome_trace
+
+
+OUTPUT_FORMAT_CSV = 'csv'
+OUTPUT_FORMAT_JSON = 'json'
+OUTPUT_FORMATS = [OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_JSON]
+
+CSV_FIELDS = ['base', 'query', 'algorithm', 'match_index', 'x', 'y', 'width', 'height', 'score']
+DURATION_FIELD_PREFIX = 'duration: '
+
+# Per worker process state, set up once by the pool initializer.
+_worker_state = {}
+
+
+def _init_worker(base_filename: str, settings: dict, opencv_threads: int, cache_sizes: dict,
+                 image_cache_directory: str, tile_size: int, tracing: bool, library_directory: str):
+    enable_tracing(tracing)
+    cv2.setNumThreads(opencv_threads)
+    configure_caches(cache_sizes)
+    set_disk_cache_directory(image_cache_directory)
+    _worker_state['base'] = load_image(base_filename)
+    _worker_state['library'] = None if library_directory is None else TemplateLibrary(library_directory)
+    # Tiles are prepared on their own, preparing the whole base would defeat the purpose of tiling.
+    _worker_state['prepared_base'] = None if tile_size else prepare(_worker_state['base'], settings)
+
+
+def _run_queries(settings: dict, threads: int, tile_size: int, multi_template: bool, query_filenames: list[str]):
+    timer = Timer('Query loading', queries=len(query_filenames))
+    timer.start()
+    query_images = [load_image(query_filename) for query_filename in query_filenames]
+    if _worker_state['library'] is not None:
+        # Templates from a library do not need their features detected again.
+        for query_filename, query_image in zip(query_filenames, query_images):
+            _worker_state['library'].seed_features(query_filename, query_image, settings)
+    timer.stop()
+    found = find_all(_worker_state['base'], query_images, settings, threads, _worker_state['prepared_base'],
+                     tile_size, multi_template)
+    # Trace events (if any) travel back along with the results of each chunk.
+    return [{'query': query_filename, **result} for query_filename, result in zip(query_filenames, found)], \
+        drain_trace_events()
+
+
+def find_all(base_image, query_images: list, settings: dict, threads: int = 1, prepared_base: dict = None,
+             tile_size: int = None, multi_template: bool = False):
+    find_function = PARAMETER_SPECS['find_functions'][settings['algorithm']]
+    if tile_size:
+        # Queries go one at a time, with their tiles being searched in parallel instead.
+        return [find_tiled(find_function, base_image, query_image, tile_size=tile_size, threads=threads, **settings)
+                for query_image in query_images]
+    if prepared_base is None:
+        prepared_base = prepare(base_image, settings)
+    find_many_function = PARAMETER_SPECS['find_many_functions'][settings['algorithm']]
+    if multi_template and find_many_function is not None:
+        # A single (internally parallel) search for every query, instead of one per query.
+        return find_many_function(base_image, query_images, prepared_base=prepared_base, **settings)
+    find_function = partial(find_function, base_image, prepared_base=prepared_base, **settings)
+    if threads == 1:
+        return [find_function(query_image) for query_image in query_images]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(find_function, query_images))
+
+
+def get_output_format(output_filename: str, output_format: str = None):
+    if output_format is None:
+        output_format = os.path.splitext(output_filename)[1].lstrip('.').lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(f'Unsupported output format "{output_format}" (expected one of {OUTPUT_FORMATS}).')
+    return output_format
+
+
+def prepare(base_image, settings: dict):
+    return PARAMETER_SPECS['prepare_functions'][settings['algorithm']](base_image, **settings)
+
+
+def run_batch(base_filename: str, query_filenames: list[str], settings: dict, processes: int = None,
+              threads: int = 1, cache_sizes: dict = None, image_cache_directory: str = None, tile_size: int = None,
+              trace_filename: str = None, library_directory: str = None, multi_template: bool = False):
+    processes = os.cpu_count() if processes is None else processes
+    # With several workers, OpenCV's own thread pool only oversubscribes the cores.
+    opencv_threads = 1 if processes * threads > 1 else -1
+    # Queries are sent in chunks, each of them matched by a worker's threads against its prepared base (or all at once,
+    # for multi-template matching, which is better off with fewer and larger chunks).
+    chunk_size = max(threads, len(query_filenames) // (processes * (1 if multi_template else 4)))
+    chunks = [query_filenames[i:i + chunk_size] for i in range(0, len(query_filenames), chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(base_filename, settings, opencv_threads, cache_sizes or {},
+                                       image_cache_directory, tile_size, trace_filename is not None,
+                                       library_directory)) as executor:
+        chunk_outputs = list(executor.map(partial(_run_queries, settings, threads, tile_size, multi_template), chunks))
+    results = [result for chunk_results, _ in chunk_outputs for result in chunk_results]
+    if trace_filename is not None:
+        write_chrome_trace([event for _, chunk_events in chunk_outputs for event in chunk_events], trace_filename)
+    return {'base': base_filename, 'algorithm': settings['algorithm'], 'parameters': settings, 'results': results}
+
+
+def write_csv(batch_result: dict, output_filename: str):
+    duration_fields = []
+    for result in batch_result['results']:
+        duration_fields.extend([mark for mark in result['duration'] if mark not in duration_fields])
+    with open(output_filename, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, CSV_FIELDS + [DURATION_FIELD_PREFIX + mark for mark in duration_fields])
+        writer.writeheader()
+        for result in batch_result['results']:
+            row = {'base': batch_result['base'], 'query': result['query'], 'algorithm': batch_result['algorithm']}
+            row.update({DURATION_FIELD_PREFIX + mark: value for mark, value in result['duration'].items()})
+            if len(result['matches']) == 0:
+                writer.writerow(row)
+            for match_index, match in enumerate(result['matches']):
+                x, y, width, height = match['box']
+                writer.writerow(dict(row, match_index=match_index, x=x, y=y, width=width, height=height,
+                                     score=match['score']))
+
+
+def write_json(batch_result: dict, output_filename: str):
+    with open(output_filename, 'w', encoding='utf-8') as f:
+        json.dump(batch_result, f, indent=4)
+
+
+def write_results(batch_result: dict, output_filename: str, output_format: str = None):
+    OUTPUT_WRITERS[get_output_format(output_filename, output_format)](batch_result, output_filename)
+
+
+OUTPUT_WRITERS = {
+    OUTPUT_FORMAT_CSV: write_csv,
+    OUTPUT_FORMAT_JSON: write_json,
+}
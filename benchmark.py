@@ -0,0 +1,196 @@
+import argparse
+import cv2
+import glob
+import json
+import numpy
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from algorithms import PARAMETER_SPECS
+from algorithms.simple_convolution_matching.fft import benchmark_engines
+from algorithms.simple_convolution_matching.matcher import METHODS
+from image_filters.color_space import COLOR_PARAM_SPECS, change_color_space_from_bgr
+from images import load_image
+from settings import fill_param_blanks
+from utils import get_iou
+
+
+BASE_FILENAME = 'tests/base.jpg'
+CASE_CORPUS = 'corpus'
+CASE_SYNTHETIC = 'synthetic'
+ENGINE_TEMPLATE_SIZES = [8, 16, 32, 64, 128, 256]
+SYNTHETIC_MEGAPIXELS = [1, 10, 100]
+SYNTHETIC_TEMPLATE_FILENAME = 'tests/template.jpg'
+TEMPLATE_GLOB = 'tests/template-*.jpg'
+
+# A case regresses when its total duration or peak memory grows by more than this fraction over the baseline.
+REGRESSION_TOLERANCE = 0.2
+# Synthetic bases count as found when the best match overlaps the planted template by at least this much (IoU).
+FOUND_IOU_THRESHOLD = 0.5
+
+
+def _run_case(case: dict):
+    # Run in a process of its own, so that the peak memory (maximum resident set size) belongs to this case only.
+    query_image = load_image(case['query'])
+    planted_box = None
+    if case['kind'] == CASE_SYNTHETIC:
+        base_image, planted_box = generate_synthetic_base(case['megapixels'], query_image)
+    else:
+        base_image = load_image(case['base'])
+    settings = fill_param_blanks(PARAMETER_SPECS['parameters'], {})[case['algorithm']]
+    start = time.perf_counter()
+    found = PARAMETER_SPECS['find_functions'][case['algorithm']](base_image, query_image, **settings)
+    elapsed = time.perf_counter() - start
+    result = {
+        **case,
+        'duration': found['duration'],
+        'matches': len(found['matches']),
+        # Linux reports it in kilobytes.
+        'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'megapixels_per_second': base_image.shape[0] * base_image.shape[1] / 1e6 / elapsed,
+    }
+    if planted_box is not None:
+        result['found'] = len(found['matches']) > 0 and \
+            get_iou(found['matches'][0]['box'], planted_box) >= FOUND_IOU_THRESHOLD
+    return result
+
+
+def compare_to_baseline(results: list[dict], baseline: list[dict], tolerance: float = REGRESSION_TOLERANCE):
+    baseline_by_key = {get_case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_by_key.get(get_case_key(result))
+        if previous is None:
+            continue
+        for metric, current_value, previous_value in [
+            ('duration', result['duration']['total'], previous['duration']['total']),
+            ('peak_memory_mb', result['peak_memory_mb'], previous['peak_memory_mb']),
+        ]:
+            if current_value > previous_value * (1 + tolerance):
+                regressions.append({'case': get_case_key(result), 'metric': metric, 'baseline': previous_value,
+                                    'current': current_value})
+        if previous.get('found') and not result.get('found', True):
+            regressions.append({'case': get_case_key(result), 'metric': 'found', 'baseline': True, 'current': False})
+    return regressions
+
+
+def get_fft_crossovers(engine_results: list[dict]):
+    # Per color space, the smallest template size from which the FFT engine beats the spatial one for every method.
+    crossovers = {}
+    for color_space in dict.fromkeys(result['color_space'] for result in engine_results):
+        results = [result for result in engine_results if result['color_space'] == color_space]
+        crossover = None
+        for size in sorted({result['template_size'] for result in results}, reverse=True):
+            if not all(result['fft'] < result['spatial'] for result in results if result['template_size'] == size):
+                break
+            crossover = size
+        crossovers[color_space] = crossover
+    return crossovers
+
+
+def generate_synthetic_base(megapixels: float, template_image, seed: int = 0):
+    random = numpy.random.default_rng(seed)
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = int(round(megapixels * 1e6 / width))
+    # Smooth random texture: upscaled noise is much cheaper to generate than blurred full-size noise.
+    channels = template_image.shape[2] if len(template_image.shape) > 2 else 1
+    noise = random.integers(0, 256, (max(height // 8, 1), max(width // 8, 1), channels), numpy.uint8)
+    base_image = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC).reshape(height, width, channels)
+    if channels == 1:
+        base_image = base_image[:, :, 0]
+    qh, qw = template_image.shape[:2]
+    x, y = int(random.integers(0, width - qw)), int(random.integers(0, height - qh))
+    base_image[y:y + qh, x:x + qw] = template_image
+    return base_image, [x, y, qw, qh]
+
+
+def get_args():
+    ap = argparse.ArgumentParser(description='Runs every algorithm (with default parameters) over the tests corpus '
+                                             'and synthetic bases with planted templates.')
+    ap.add_argument('-a', '--algorithms', nargs='+', choices=PARAMETER_SPECS['algorithms'],
+                    default=PARAMETER_SPECS['algorithms'], help='Algorithms to benchmark (default: all)')
+    ap.add_argument('-b', '--baseline', help='Baseline results filename to compare against')
+    ap.add_argument('--engines', help='Also time the Match Template engines (spatial and FFT) on the corpus base, for '
+                                      'square templates of several sizes, writing the timings to this filename')
+    ap.add_argument('-m', '--megapixels', nargs='*', type=float, default=SYNTHETIC_MEGAPIXELS,
+                    help=f'Synthetic base sizes, in megapixels (default: {SYNTHETIC_MEGAPIXELS})')
+    ap.add_argument('-o', '--output', default='benchmark.json', help='Results filename (default: benchmark.json)')
+    ap.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                    help=f'Allowed growth over the baseline before flagging a regression (default: '
+                         f'{REGRESSION_TOLERANCE})')
+    args = vars(ap.parse_args())
+    assert args['tolerance'] >= 0, 'Tolerance must not be negative.'
+    return args
+
+
+def get_case_key(case: dict):
+    source = f'{case["megapixels"]}MP' if case['kind'] == CASE_SYNTHETIC else os.path.basename(case['query'])
+    return f'{case["algorithm"]} | {case["kind"]} | {source}'
+
+
+def get_cases(algorithms: list[str], template_filenames: list[str], synthetic_megapixels: list[float]):
+    cases = []
+    for algorithm in algorithms:
+        cases.extend({'algorithm': algorithm, 'kind': CASE_CORPUS, 'base': BASE_FILENAME, 'query': template_filename}
+                     for template_filename in template_filenames)
+        cases.extend({'algorithm': algorithm, 'kind': CASE_SYNTHETIC, 'megapixels': megapixels,
+                      'query': SYNTHETIC_TEMPLATE_FILENAME} for megapixels in synthetic_megapixels)
+    return cases
+
+
+def main():
+    args = get_args()
+    cases = get_cases(args['algorithms'], sorted(glob.glob(TEMPLATE_GLOB)), args['megapixels'])
+    results = run_benchmark(cases)
+    with open(args['output'], 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=4)
+    for result in results:
+        found = '' if 'found' not in result else (' found' if result['found'] else ' NOT FOUND')
+        print(f'{get_case_key(result)}: {result["duration"]["total"]:.3f} s, {result["peak_memory_mb"]:.0f} MB, '
+              f'{result["megapixels_per_second"]:.1f} MP/s{found}')
+    print(f'{len(results)} cases benchmarked. Results written to {args["output"]}.')
+    if args['baseline'] is not None:
+        with open(args['baseline'], 'r', encoding='utf-8') as f:
+            regressions = compare_to_baseline(results, json.load(f), args['tolerance'])
+        for regression in regressions:
+            print(f'REGRESSION {regression["case"]} ({regression["metric"]}): {regression["baseline"]} -> '
+                  f'{regression["current"]}')
+        if len(regressions) > 0:
+            sys.exit(1)
+    if args['engines'] is not None:
+        engine_results = run_engine_benchmark(ENGINE_TEMPLATE_SIZES)
+        with open(args['engines'], 'w', encoding='utf-8') as f:
+            json.dump(engine_results, f, indent=4)
+        for result in engine_results:
+            print(f'{result["color_space"]} {result["method"]} {result["template_size"]}px: spatial '
+                  f'{result["spatial"]:.3f} s, FFT {result["fft"]:.3f} s')
+        for color_space, crossover in get_fft_crossovers(engine_results).items():
+            print(f'{color_space}: ' + ('the FFT engine is not faster, even for the largest templates.'
+                                        if crossover is None else
+                                        f'the FFT engine is faster from {crossover}x{crossover} templates on '
+                                        f'(fft_min_template_pixels: {crossover * crossover}).'))
+        print(f'Engine timings written to {args["engines"]}.')
+
+
+def run_benchmark(cases: list[dict]):
+    # One case at a time (so that they do not compete for the CPU), each one in a fresh process (a pool of its own, as
+    # max_tasks_per_child needs Python 3.11).
+    results = []
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results.append(executor.submit(_run_case, case).result())
+    return results
+
+
+def run_engine_benchmark(template_sizes: list[int]):
+    base_image = load_image(BASE_FILENAME)
+    method_enums = {name: method['enum'] for name, method in METHODS.items()}
+    return [{'color_space': color_space, **result} for color_space in COLOR_PARAM_SPECS['color_space']['options']
+            for result in benchmark_engines(change_color_space_from_bgr(color_space, [base_image])[0], template_sizes,
+                                            method_enums)]
+
+
+if __name__ == '__main__':
+    main()
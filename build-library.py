@@ -0,0 +1,57 @@
+import argparse
+import glob
+import yaml
+from algorithms import PARAMETER_SPECS
+from algorithms.feature_matching.detectors import DETECTOR_PARAM_SPECS, DETECTOR_SIFT, DETECTORS
+from algorithms.feature_matching.library import DEFAULT_BRANCHING, DEFAULT_DEPTH, build_library
+from image_filters.color_space import COLOR_PARAM_SPECS
+from settings import fill_param_blanks
+from utils import filter_dict_keys, flat_map
+
+
+def get_args():
+    ap = argparse.ArgumentParser(description='Extracts the features of a template collection once, into an on-disk '
+                                             'library with a vocabulary tree, for headless mode (--library) to pick '
+                                             'candidate templates from.')
+    ap.add_argument('templates', nargs='*', help='Template filenames or patterns (default: the configuration file '
+                                                 'queries)')
+    ap.add_argument('--branching', type=int, default=DEFAULT_BRANCHING,
+                    help=f'Vocabulary tree branching factor (default: {DEFAULT_BRANCHING})')
+    ap.add_argument('-c', '--config', default='config.yaml', help='Configuration file, for the feature detection '
+                                                                  'parameters (default: config.yaml)')
+    ap.add_argument('--color-space', choices=COLOR_PARAM_SPECS['color_space']['options'],
+                    help='Color space (default: the configuration file one)')
+    ap.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                    help=f'Vocabulary tree depth, giving branching^depth visual words (default: {DEFAULT_DEPTH})')
+    ap.add_argument('-d', '--detector', choices=list(DETECTORS.keys()),
+                    help=f'Feature detector (default: the configuration file one, or {DETECTOR_SIFT})')
+    ap.add_argument('-o', '--output', required=True, help='Library directory')
+    ap.add_argument('-t', '--threads', type=int, help='Feature extraction thread count (default: CPU count)')
+    args = vars(ap.parse_args())
+    with open(args['config'], 'r', encoding='utf-8') as f:
+        data = yaml.load(f.read(), yaml.Loader)
+    parameters = data.get('parameters') or {}
+    algorithm = next(iter(parameters.keys())) if len(parameters.keys()) > 0 else 'Match Template'
+    args['settings'] = fill_param_blanks(PARAMETER_SPECS['parameters'], parameters)[algorithm]
+    args['settings']['color_space'] = args['color_space'] or args['settings']['color_space']
+    args['settings']['detector'] = args['detector'] or args['settings'].get('detector', DETECTOR_SIFT)
+    args['templates'] = flat_map([glob.glob(pattern) for pattern in args['templates'] or data.get('query') or []])
+    assert len(args['templates']) > 0, 'Need template filenames either on command line or in config file.'
+    assert args['branching'] > 1, 'Branching factor must be more than one.'
+    assert args['depth'] > 0, 'Depth must be positive.'
+    assert args['threads'] is None or args['threads'] > 0, 'Thread count must be positive.'
+    return args
+
+
+def main():
+    args = get_args()
+    settings = args['settings']
+    build_library(args['output'], sorted(set(args['templates'])), settings['color_space'], settings['detector'],
+                  filter_dict_keys(settings, DETECTOR_PARAM_SPECS[settings['detector']].keys()), args['branching'],
+                  args['depth'], args['threads'])
+    print(f'{len(set(args["templates"]))} templates ({args["settings"]["detector"]} features) written to '
+          f'{args["output"]}.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import hashlib
+import numpy
+import os
+import pickle
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+
+MEGABYTE = 1024 * 1024
+
+# Named caches whose budgets can be set from the configuration file ("caches" section, in megabytes).
+CACHES = {}
+
+_image_hashes = {}
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int, spill_directory: str = None):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_bytes = max_bytes
+        self._spill_directory = spill_directory
+        self._total_bytes = 0
+        self.name = None
+
+    # Evicted entries are returned instead of spilled, as they are written to disk only once the lock is released.
+    def _evict(self):
+        evicted = []
+        while self._total_bytes > self._max_bytes and len(self._entries) > 0:
+            key, (value, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            evicted.append((key, value, size))
+        return evicted
+
+    def _spill(self, evicted: list):
+        if self._spill_directory is None:
+            return
+        for key, value, size in evicted:
+            path = self._spill_path(key)
+            # Entries are immutable for a given key, so the ones brought back from disk need no writing again.
+            if not os.path.isfile(path):
+                # Written under a temporary name first, as other threads may be reading it back meanwhile.
+                temporary_path = f'{path}.{threading.get_ident()}.tmp'
+                with open(temporary_path, 'wb') as f:
+                    pickle.dump((value, size), f)
+                os.replace(temporary_path, path)
+
+    def _spill_path(self, key):
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return os.path.join(self._spill_directory, f'{digest}.pickle')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        # Entries evicted to disk are brought back into memory when used again.
+        if self._spill_directory is not None and os.path.isfile(self._spill_path(key)):
+            with open(self._spill_path(key), 'rb') as f:
+                value, size = pickle.load(f)
+            if size <= self._max_bytes:
+                self.put(key, value, size)
+            return value
+        return default
+
+    def put(self, key, value, size: int):
+        # Entries over the whole budget go straight to disk (if anywhere).
+        evicted = [(key, value, size)]
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            fits = size <= self._max_bytes
+            if fits:
+                self._entries[key] = (value, size)
+                self._total_bytes += size
+                evicted = self._evict()
+        self._spill(evicted)
+        if not fits and self._spill_directory is None:
+            print(f'Warning: {size / MEGABYTE:.1f} MB entry not cached, as it exceeds the '
+                  f'{self._max_bytes / MEGABYTE:.1f} MB budget of the "{self.name}" cache (see the "caches" section of '
+                  f'the configuration file).', file=sys.stderr)
+
+    def set_max_bytes(self, max_bytes: int):
+        with self._lock:
+            self._max_bytes = max_bytes
+            evicted = self._evict()
+        self._spill(evicted)
+
+    def set_spill_directory(self, spill_directory: str = None):
+        if spill_directory is not None:
+            os.makedirs(spill_directory, exist_ok=True)
+        self._spill_directory = spill_directory
+
+    def total_bytes(self):
+        return self._total_bytes
+
+
+def clear_caches():
+    for cache in CACHES.values():
+        cache.clear()
+
+
+def configure_caches(cache_sizes: dict):
+    for name, size in cache_sizes.items():
+        if name not in CACHES:
+            raise Exception(f'Unknown cache "{name}" in configuration (expected one of {sorted(CACHES.keys())}).')
+        CACHES[name].set_max_bytes(int(size * MEGABYTE))
+
+
+def hash_image(image):
+    # Hashes are remembered for as long as the image object lives, as the same base is hashed over and over.
+    image_id = id(image)
+    if image_id not in _image_hashes:
+        digest = hashlib.blake2b(f'{image.shape}{image.dtype.str}'.encode(), digest_size=16)
+        digest.update(numpy.ascontiguousarray(image).data)
+        _image_hashes[image_id] = digest.hexdigest()
+        weakref.finalize(image, _image_hashes.pop, image_id, None)
+    return _image_hashes[image_id]
+
+
+def register_cache(name: str, cache: LRUCache):
+    cache.name = name
+    CACHES[name] = cache
+    return cache
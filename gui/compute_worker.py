@@ -0,0 +1,122 @@
+import sys
+import threading
+import time
+from utils import print_traceback
+
+
+class ComputeWorker:
+    DEBOUNCE_SECONDS = 0.15
+
+    # The compute function is expected to cache its results, which the lookup function retrieves for the same request
+    # arguments.
+    def __init__(self, compute_function, lookup_function, debounce_seconds: float = DEBOUNCE_SECONDS,
+                 result_listener=None):
+        self._compute_function = compute_function
+        self._condition = threading.Condition()
+        self._debounce_seconds = debounce_seconds
+        self._finished = None
+        self._generation = 0
+        self._lookup_function = lookup_function
+        self._pending = None
+        self._prefetch_queue = []
+        self._result_listener = result_listener
+        self._running_generation = None
+        self._stopping = False
+        self._submitted_at = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # Failed computations are finished too (with their exception instead of a result), so that they can be reported.
+    def _finish(self, generation: int, request: dict, result, error: BaseException = None):
+        with self._condition:
+            if self._running_generation == generation:
+                self._running_generation = None
+            if self._pending is not None and self._pending[0] == generation:
+                self._pending = None
+            # Results for superseded requests are dropped, the newer request is already pending or running.
+            if generation == self._generation and (result is not None or error is not None):
+                self._finished = (request, result, error)
+                if self._result_listener is not None:
+                    self._result_listener()
+
+    # Returns the request generation (None for prefetches), the request and whether its cached result is yet to be
+    # looked up.
+    def _next_request(self):
+        with self._condition:
+            while not self._stopping:
+                if self._pending is not None:
+                    generation, request, looked_up = self._pending
+                    if not looked_up:
+                        # Cached results are shown right away, without waiting for bursts to settle.
+                        self._pending = (generation, request, True)
+                        return generation, request, True
+                    # Bursts (e.g. slider drags) are collapsed: only requests left alone for a while get computed.
+                    remaining = self._submitted_at + self._debounce_seconds - time.monotonic()
+                    if remaining > 0:
+                        self._condition.wait(remaining)
+                        continue
+                    self._pending = None
+                    self._running_generation = generation
+                    return generation, request, False
+                if len(self._prefetch_queue) > 0:
+                    # Prefetches carry no generation: their results are only cached, never shown.
+                    return None, self._prefetch_queue.pop(0), True
+                self._condition.wait()
+            return None, None, False
+
+    def _run(self):
+        while True:
+            generation, request, lookup = self._next_request()
+            if request is None:
+                return
+            if lookup:
+                # Lookups may be expensive (e.g. decoding and hashing images), so they are done without the lock.
+                try:
+                    cached = self._lookup_function(**request)
+                except:
+                    # Left for the computation to fail (and be reported) instead, if it is not a prefetch.
+                    print_traceback(sys.exc_info())
+                    cached = None
+                if generation is not None and cached is not None:
+                    self._finish(generation, request, cached)
+                if generation is not None or cached is not None:
+                    continue
+            error = None
+            try:
+                result = self._compute_function(**request)
+            except:
+                print_traceback(sys.exc_info())
+                result, error = None, sys.exc_info()[1]
+            if generation is not None:
+                self._finish(generation, request, result, error)
+
+    def is_busy(self):
+        with self._condition:
+            return self._pending is not None or self._running_generation is not None
+
+    def poll_result(self):
+        with self._condition:
+            finished, self._finished = self._finished, None
+            return finished
+
+    def prefetch(self, requests: list[dict]):
+        with self._condition:
+            # Cache lookups are left to the worker thread, as they may be expensive (e.g. hashing images).
+            self._prefetch_queue = list(requests)
+            self._condition.notify_all()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def submit(self, **request):
+        with self._condition:
+            self._generation += 1
+            self._pending = (self._generation, request, False)
+            # Speculative work queued for older settings or positions is cancelled.
+            self._prefetch_queue = []
+            self._submitted_at = time.monotonic()
+            self._finished = None
+            self._condition.notify_all()
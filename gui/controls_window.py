@@ -137,6 +137,7 @@ class ControlsWindow:
 
     def _on_change_algorithm(self, *args):
         self._reread_settings()
+        self._broadcast_listeners()
 
     def _on_close_window(self, *args):
         self._quitting_ref['quitting'] = True
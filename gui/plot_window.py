@@ -18,29 +18,46 @@ class PlotWindow:
         self._initial_center = center
         self._initial_scale = scale
         self._is_loading = False
+        self._listeners = []
+        self._mipmaps = []
+        self._needs_redraw = False
         self._title = None
+        self._window_buffer = None
         self.center = center
         self.scale = scale
         cv2.namedWindow(PlotWindow.WINDOW_NAME, cv2.WINDOW_NORMAL)
         cv2.resizeWindow(PlotWindow.WINDOW_NAME, dimensions[0], dimensions[1])
         cv2.setMouseCallback(PlotWindow.WINDOW_NAME, self._on_mouse)
 
+    def _build_mipmaps(self):
+        # Each level halves the previous one, down to the first one that is enough for the minimum scale.
+        self._mipmaps = [self._full_plot_image]
+        while 0.5 ** len(self._mipmaps) >= PlotWindow.MIN_SCALE and min(self._mipmaps[-1].shape[:2]) > 1:
+            self._mipmaps.append(cv2.pyrDown(self._mipmaps[-1]))
+
     def _crop_to_win_size(self):
-        ih, iw = self._scaled_plot_image.shape[:2]
+        ih, iw = self._get_scaled_shape()
         cx, cy = self.center
         wh, ww = self.get_window_dimensions()
         half_wh, half_ww = (wh // 2, ww // 2)
         top = int(max(cy - half_wh, 0))
-        bottom = int(min(cy - half_wh + wh, ih))
         left = int(max(cx - half_ww, 0))
-        right = int(min(cx - half_ww + ww, iw))
-        self._cropped_plot_image = numpy.zeros((wh, ww), numpy.uint8) if self._color_space == COLOR_BW else \
-            numpy.zeros((wh, ww, 3), numpy.uint8)
-        self._cropped_plot_image[0:bottom - top, 0:right - left] = \
-            self._scaled_plot_image[top:bottom, left:right]
+        buffer_shape = (wh, ww) if self._color_space == COLOR_BW else (wh, ww, 3)
+        if self._window_buffer is None or self._window_buffer.shape != buffer_shape:
+            self._window_buffer = numpy.zeros(buffer_shape, numpy.uint8)
+        # Only the visible region is resampled, from the smallest level that still has enough detail.
+        level = 0
+        while level + 1 < len(self._mipmaps) and 0.5 ** (level + 1) >= self.scale:
+            level += 1
+        factor = self.scale / 0.5 ** level
+        t_matrix = numpy.float32([[factor, 0, -left], [0, factor, -top]])
+        cv2.warpAffine(self._mipmaps[level], t_matrix, (ww, wh), dst=self._window_buffer,
+                       flags=cv2.INTER_LINEAR if factor < 1 else cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT,
+                       borderValue=0)
+        self._cropped_plot_image = self._window_buffer
 
     def _fix_center(self):
-        ih, iw = self._scaled_plot_image.shape[:2]
+        ih, iw = self._get_scaled_shape()
         cx, cy = (ih // 2, iw // 2) if self.center is None else self.center
         wh, ww = self.get_window_dimensions()
         if cx < ww // 2:
@@ -53,6 +70,10 @@ class PlotWindow:
             cy = ih - wh // 2
         self.center = (cx, cy)
 
+    def _get_scaled_shape(self):
+        fh, fw = self._full_plot_image.shape[:2]
+        return int(round(fh * self.scale)), int(round(fw * self.scale))
+
     def _on_mouse(self, event: int, x: int, y: int, flag: int, userdata):
         if flag & cv2.EVENT_FLAG_LBUTTON:
             if self._dragging is not None:
@@ -67,8 +88,14 @@ class PlotWindow:
                 self.scale_down((x, y))
             self.set_title(self._title)
 
+    def _request_redraw(self):
+        # Mouse events only update the view parameters, redrawing is left to the main loop (at a capped rate).
+        self._needs_redraw = True
+        for listener in self._listeners:
+            listener()
+
     def _scale_plot(self):
-        self._scaled_plot_image = cv2.resize(self._full_plot_image, (0, 0), fx=self.scale, fy=self.scale)
+        self._needs_redraw = False
         self._fix_center()
         self._show()
 
@@ -76,6 +103,9 @@ class PlotWindow:
         self._crop_to_win_size()
         cv2.imshow(PlotWindow.WINDOW_NAME, self._cropped_plot_image)
 
+    def add_change_listener(self, listener):
+        self._listeners.append(listener)
+
     # noinspection PyMethodMayBeStatic
     def destroy(self):
         if self.is_open():
@@ -94,12 +124,17 @@ class PlotWindow:
 
     def move_center(self, delta: tuple[int, int]):
         self.center = (self.center[0] + delta[0], self.center[1] + delta[1])
-        self._fix_center()
-        self._show()
+        self._request_redraw()
 
     def redraw(self):
         self._scale_plot()
 
+    def redraw_if_needed(self):
+        if not self._needs_redraw or self._full_plot_image is None:
+            return False
+        self._scale_plot()
+        return True
+
     def reset_center(self):
         self.center = self._initial_center
         self._scale_plot()
@@ -118,12 +153,12 @@ class PlotWindow:
     def scale_down(self, at: tuple[int, int]):
         if self.scale > PlotWindow.MIN_SCALE:
             self.scale -= PlotWindow.SCALE_STEP
-        self._scale_plot()
+        self._request_redraw()
 
     def scale_up(self, at: tuple[int, int]):
         if self.scale < PlotWindow.MAX_SCALE:
             self.scale += PlotWindow.SCALE_STEP
-        self._scale_plot()
+        self._request_redraw()
 
     def set_loading(self):
         self._is_loading = True
@@ -135,6 +170,7 @@ class PlotWindow:
         else:
             self._color_space = COLOR_BW
         self._full_plot_image = plot_image
+        self._build_mipmaps()
         self._scale_plot()
         self.set_title(title)
 
@@ -2,13 +2,27 @@ import argparse
 import cv2
 import glob
 import os
+import queue
+import time
 import yaml
+from batch import OUTPUT_FORMATS, get_output_format, run_batch, write_results
+from caching import LRUCache, MEGABYTE, configure_caches, hash_image, register_cache
+from functools import partial
+from gui.compute_worker import ComputeWorker
 from gui.controls_window import ControlsWindow
 from algorithms import PARAMETER_SPECS
+from algorithms.feature_matching.library import TemplateLibrary
 from gui.plot_window import PlotWindow
+from images import ImageCollection, load_image, set_disk_cache_directory
+from settings import fill_param_blanks
+from timer import drain_trace_events, enable_tracing, write_chrome_trace
 from utils import filter_dict_keys, flat_map
 
 
+CHANGE_RESULT = 'result'
+CHANGE_SETTINGS = 'settings'
+CHANGE_VIEW = 'view'
+
 KEY_BOTTOM_ARROW = 0x10000 * 0x28
 KEY_ESC = 0x1B
 KEY_F1 = 0x700000
@@ -20,63 +34,64 @@ KEY_RIGHT_ARROW = 0x10000 * 0x27
 KEY_SPACE = 0x20
 KEY_UP_ARROW = 0x10000 * 0x26
 
+# Results for the queries up to this many positions before and after the current one are computed while idle.
+PREFETCH_DISTANCE = 2
+
+# The main loop waits for window events for up to WAIT_IDLE_MS, or WAIT_ACTIVE_MS while there is something going on
+# (i.e. during ACTIVE_SECONDS after the last change, or while a plot is being computed).
+ACTIVE_SECONDS = 1.0
+WAIT_ACTIVE_MS = 10
+WAIT_IDLE_MS = 100
+MAX_REDRAWS_PER_SECOND = 60
+
+# Library templates fully matched against the base, out of the ones scoring best on the vocabulary tree.
+LIBRARY_CANDIDATES = 10
+
+# Plot results, by base and query contents, algorithm and parameters.
+PLOT_CACHE = register_cache('plots', LRUCache(256 * MEGABYTE))
+
+
+def compute_plot(base: dict, query: ImageCollection, query_index: int, settings: dict, use_cache: bool = True):
+    return plot(base['image'], query[query_index]['image'], use_cache=use_cache, **settings)
+
 
 def create_controls_window(base_image, query_image, query_index_ref, view_settings_ref, quitting_ref):
     controls_window = ControlsWindow(quitting_ref, PARAMETER_SPECS, view_settings_ref)
     return controls_window
 
 
-def fill_param_algorithm(algorithm: str, result: dict) -> None:
-    if algorithm not in result:
-        result[algorithm] = {'algorithm': algorithm}
-    elif 'algorithm' not in result[algorithm]:
-        result[algorithm]['algorithm'] = algorithm
-    elif result[algorithm]['algorithm'] != algorithm:
-        raise Exception(f'Algorithm mismatch in configuration file.')
-
-
-def fill_param_blanks(parameter_specs: dict, config_params: dict) -> dict:
-    result = config_params.copy()
-    for algorithm, conditionals in parameter_specs.items():
-        fill_param_algorithm(algorithm, result)
-        for conditional in conditionals:
-            for condition, params in conditional.items():
-                if condition == '':
-                    for specs in params.values():
-                        fill_param_blanks_shallow(algorithm, specs, result[algorithm])
-                elif condition not in result[algorithm]:
-                    # This should never happen, due to the checks we make PARAMETER_SPECS pass.
-                    raise Exception(f'Invalid dependency in settings: "{algorithm}"."{condition}"')
-                else:
-                    for condition_value, specs in params.items():
-                        if result[algorithm][condition] == condition_value:
-                            fill_param_blanks_shallow(algorithm, specs, result[algorithm])
-                    for condition_value, specs in params.items():
-                        if result[algorithm][condition] != condition_value:
-                            fill_param_blanks_shallow(algorithm, specs, result[algorithm])
-    return result
-
-
-def fill_param_blanks_shallow(algorithm: str, specs: dict, config_params: dict) -> None:
-    for key, spec in specs.items():
-        if key in config_params:
-            if config_params[key] is None:
-                if 'nullable' not in spec or not spec['nullable']:
-                    raise Exception(f'Configuration value for "{algorithm}"."{key}" cannot be null/None.')
-                del config_params[key]
-            elif type(config_params[key]) != spec['type']:
-                raise Exception(f'Configuration type for "{algorithm}"."{key}" has an invalid type.')
-            elif 'options' in spec and config_params[key] not in spec['options']:
-                raise Exception(f'Configuration value for "{algorithm}"."{key}" is invalid (not in available options).')
-        elif spec['default'] is not None:
-            config_params[key] = spec['default']
+def find(base_image, query_image, algorithm: str, **kwargs):
+    return PARAMETER_SPECS['find_functions'][algorithm](base_image, query_image, algorithm, **kwargs)
 
 
 def get_args():
     ap = argparse.ArgumentParser()
     ap.add_argument('-b', '--base', help='Base (canvas) image filename')
+    ap.add_argument('--candidates', type=int, help='Headless mode library templates to fully match against the base '
+                                                   f'(default: {LIBRARY_CANDIDATES})')
     ap.add_argument('-c', '--config', help='Configuration file', default='config.yaml')
+    ap.add_argument('--headless', action='store_true', help='Run every query in batch, without GUI')
+    ap.add_argument('-l', '--library', help='Headless mode template library directory (see build-library.py), whose '
+                                            'best candidates are used as queries')
+    ap.add_argument('--multi-template', action='store_true', help='Headless mode single-pass matching of all the '
+                                                                   'queries of each worker (feature matching only)')
+    ap.add_argument('--no-plot-cache', action='store_true', help='Always recompute plots, e.g. for timing them '
+                                                                 '(also for a single plot: F5, r/R)')
+    ap.add_argument('-o', '--output', help='Headless mode results filename (.json or .csv)', default='results.json')
+    ap.add_argument('--output-format', choices=OUTPUT_FORMATS, help='Headless mode results format (default: by '
+                                                                     'output filename extension)')
+    ap.add_argument('-p', '--processes', type=int, help='Headless mode worker process count (default: CPU count)')
     ap.add_argument('-q', '--query', nargs='+', help='Query image filename')
+    ap.add_argument('--roi', nargs=4, type=int, metavar=('X', 'Y', 'WIDTH', 'HEIGHT'),
+                    help='Base region of interest, the only part of the base to search (default: the whole base)')
+    ap.add_argument('--roi-mask', help='Base region mask filename, a binary image of the same size as the base whose '
+                                       'non-zero pixels are the only ones to search (default: no mask)')
+    ap.add_argument('--tile-size', type=int, help='Headless mode base tile size, in pixels, for bounded-memory '
+                                                  'matching of very large base images (default: no tiling)')
+    ap.add_argument('--trace', help='Chrome trace-event (JSON) filename to record the run to, e.g. for '
+                                    'chrome://tracing or Perfetto')
+    ap.add_argument('-t', '--threads', type=int, default=1, help='Headless mode thread count per worker process '
+                                                                 '(default: 1)')
     ap.add_argument('-w', '--window-dimensions', help='Window dimensions ("{width}x{height}", e.g.: "800x600")')
     args = vars(ap.parse_args())
     with open(args['config'], 'r', encoding='utf-8') as f:
@@ -87,29 +102,82 @@ def get_args():
         base = args['base']
         assert base, 'Need base filename either on command line or in config file.'
         assert os.path.isfile(base) and os.access(base, os.R_OK), f'File {base} does not exist or is not readable.'
+        if args['library'] is None:
+            args['library'] = data.get('library')
+        if args['candidates'] is None:
+            args['candidates'] = data.get('library_candidates', LIBRARY_CANDIDATES)
         if not args['query']:
-            args['query'] = data['query']
-        assert args['query'], 'Need query path list either on command line or in config file.'
-        args['query'] = flat_map([glob.glob(query) for query in args['query']])
+            args['query'] = data.get('query')
+        assert args['query'] or args['library'], 'Need query path list either on command line or in config file.'
+        args['query'] = flat_map([glob.glob(query) for query in args['query'] or []])
         assert 'parameters' in data, 'Must specify parameters.'
         args['parameters'] = data['parameters']
         args['algorithm'] = next(iter(data['parameters'].keys())) if len(data['parameters'].keys()) > 0 \
             else 'Match Template'
+        args['roi'] = args['roi'] or data.get('roi')
+        args['roi_mask'] = args['roi_mask'] or data.get('roi_mask')
+        assert args['roi'] is None or (len(args['roi']) == 4 and all(type(value) == int for value in args['roi']) and
+                                       min(args['roi'][:2]) >= 0 and min(args['roi'][2:]) > 0), \
+            'Region of interest must be four integers: non-negative x and y, and positive width and height.'
+        region_settings = dict(zip(['roi_x', 'roi_y', 'roi_width', 'roi_height'], args['roi'] or []))
+        if args['roi_mask'] is not None:
+            region_settings['roi_mask'] = args['roi_mask']
+        if len(region_settings) > 0:
+            # The region is the base's, so it goes to every algorithm (e.g. for switching algorithms in the GUI).
+            args['parameters'] = {algorithm: {**(args['parameters'].get(algorithm) or {}), **region_settings}
+                                  for algorithm in dict.fromkeys([*args['parameters'], *PARAMETER_SPECS['algorithms']])}
         if args['window_dimensions'] is not None:
             data['dimensions'] = [int(size) for size in args['window_dimensions'].split('x')]
+        args['caches'] = data.get('caches', {})
+        args['cache_spill_directory'] = data.get('cache_spill_directory')
+        args['image_cache_directory'] = data.get('image_cache_directory')
+        if args['tile_size'] is None:
+            args['tile_size'] = data.get('tile_size')
+        args['multi_template'] = args['multi_template'] or data.get('multi_template', False)
+        args['prefetch_distance'] = data.get('prefetch_distance', PREFETCH_DISTANCE)
+        assert type(args['prefetch_distance']) == int and args['prefetch_distance'] >= 0, \
+            'Prefetch distance must be a non-negative integer.'
         args['config_data'] = data
+    if args['headless']:
+        args['output_format'] = get_output_format(args['output'], args['output_format'])
+        assert args['processes'] is None or args['processes'] > 0, 'Process count must be positive.'
+        assert args['threads'] > 0, 'Thread count must be positive.'
+        assert args['tile_size'] is None or args['tile_size'] > 0, 'Tile size must be positive.'
+        assert args['candidates'] > 0, 'Library candidate count must be positive.'
+    else:
+        assert len(args['query']) > 0, 'Template libraries are only used in headless mode, need query path list.'
     return args
 
 
+def get_neighbour_indices(query_index: int, query_count: int, distance: int):
+    indices = []
+    for offset in range(1, distance + 1):
+        for index in [(query_index + offset) % query_count, (query_index - offset) % query_count]:
+            if index != query_index and index not in indices:
+                indices.append(index)
+    return indices
+
+
 def load_images(base_filename: str, query_filenames: list[str]):
     return [
-        {'filename': base_filename, 'image': cv2.imread(base_filename, -1)},
-        [{'filename': query_filename, 'image': cv2.imread(query_filename, -1)} for query_filename in query_filenames]
+        {'filename': base_filename, 'image': load_image(base_filename)},
+        ImageCollection(query_filenames)
     ]
 
 
+def lookup_plot(base: dict, query: ImageCollection, query_index: int, settings: dict, use_cache: bool = True):
+    return PLOT_CACHE.get(plot_key(base['image'], query[query_index]['image'], settings)) if use_cache else None
+
+
 def main():
     args = get_args()
+    configure_caches(args['caches'])
+    PLOT_CACHE.set_spill_directory(args['cache_spill_directory'])
+    set_disk_cache_directory(args['image_cache_directory'])
+    if args['headless']:
+        run_headless(args)
+        return
+    enable_tracing(args['trace'] is not None)
     base, query = load_images(args['base'], args['query'])
     query_index = {'query_index': 0}
     plot_window_args = filter_dict_keys(args['config_data'], ['center', 'dimensions', 'scale'])
@@ -120,35 +188,115 @@ def main():
     view_settings['current'] = view_settings['all'][args['algorithm']]
     quitting_ref = {'quitting': False}
     controls_window = create_controls_window(base, query, query_index, view_settings, quitting_ref)
-    run_plots(plot_window, controls_window, base, query, query_index, view_settings, quitting_ref)
+    run_plots(plot_window, controls_window, base, query, query_index, view_settings, quitting_ref,
+              args['prefetch_distance'], not args['no_plot_cache'])
     controls_window.destroy()
+    query.destroy()
+    if args['trace'] is not None:
+        write_chrome_trace(drain_trace_events(), args['trace'])
+
+
+def plot(base_image, query_image, algorithm: str, use_cache: bool = True, **kwargs):
+    key = plot_key(base_image, query_image, {'algorithm': algorithm, **kwargs})
+    plotted = PLOT_CACHE.get(key) if use_cache else None
+    if plotted is None:
+        plotted = PARAMETER_SPECS['plot_functions'][algorithm](base_image, query_image, algorithm, **kwargs)
+        PLOT_CACHE.put(key, plotted, plotted['image'].nbytes)
+    return plotted
+
+
+def plot_key(base_image, query_image, settings: dict):
+    return hash_image(base_image), hash_image(query_image), tuple(sorted(settings.items()))
 
 
-def plot(base_image, query_image, algorithm: str, **kwargs):
-    return PARAMETER_SPECS['plot_functions'][algorithm](base_image, query_image, algorithm, **kwargs)
+def run_headless(args):
+    settings = fill_param_blanks(PARAMETER_SPECS['parameters'], args['parameters'])[args['algorithm']]
+    query_filenames, library_result = args['query'], None
+    if args['library'] is not None:
+        # Only the library templates most likely to be on the base get fully matched.
+        library_result = TemplateLibrary(args['library']).get_candidates(load_image(args['base']), args['candidates'])
+        query_filenames = [candidate['query'] for candidate in library_result['candidates']]
+    batch_result = run_batch(args['base'], query_filenames, settings, args['processes'], args['threads'],
+                             args['caches'], args['image_cache_directory'], args['tile_size'], args['trace'],
+                             args['library'], args['multi_template'])
+    if library_result is not None:
+        batch_result['library'] = {'directory': args['library'], **library_result}
+    write_results(batch_result, args['output'], args['output_format'])
+    print(f'{len(batch_result["results"])} queries processed. Results written to {args["output"]}.')
 
 
-def run_plots(plot_window, controls_window, base, query, query_index_ref, settings_ref, quitting_ref):
+def run_plots(plot_window, controls_window, base, query, query_index_ref, settings_ref, quitting_ref,
+              prefetch_distance: int = PREFETCH_DISTANCE, use_cache: bool = True):
     last_index = None
     last_params = None
     last_window_dimensions = None
+    reprocessing = False
+    # Everything that may need a reaction from this loop is posted to this queue, so that nothing is polled.
+    changes = queue.Queue()
+    controls_window.add_change_listener(lambda **kwargs: changes.put(CHANGE_SETTINGS))
+    plot_window.add_change_listener(lambda: changes.put(CHANGE_VIEW))
+    # Plots are computed in the background, so that the window keeps handling events meanwhile.
+    compute_worker = ComputeWorker(partial(compute_plot, base, query), partial(lookup_plot, base, query),
+                                   result_listener=lambda: changes.put(CHANGE_RESULT))
+    pending = {CHANGE_SETTINGS}
+    last_activity = time.monotonic()
+    last_redraw = 0.0
     while plot_window.is_open() and not quitting_ref['quitting']:
-        if last_params != settings_ref['current'] or last_index != query_index_ref['query_index']:
+        while not changes.empty():
+            pending.add(changes.get_nowait())
+        now = time.monotonic()
+        if len(pending) > 0:
+            last_activity = now
+        finished = None
+        if CHANGE_SETTINGS in pending and (last_params != settings_ref['current'] or
+                                           last_index != query_index_ref['query_index']):
             last_index = query_index_ref['query_index']
             # No matter if this is not the one used for comparison, it's newer:
             last_params = settings_ref['current'].copy()
-            last_window_dimensions = plot_window.get_window_dimensions()
-            a_query = query[last_index]
-            plot_window.set_loading()
             print('PLOT PARAMETERS:', last_params)
-            plotted = plot(base['image'], a_query['image'], **last_params)
-            controls_window.record_last_duration(plotted['duration'])
-            plot_window.set_plot_image(plotted['image'], f'{base["filename"]} <-- {a_query["filename"]}')
-            plot_window.unset_loading()
-        elif last_window_dimensions != plot_window.get_window_dimensions():
+            reading_cache = use_cache and not reprocessing
+            reprocessing = False
+            query.preload(get_neighbour_indices(last_index, len(query), prefetch_distance))
+            # Even cached plots are looked up by the worker, as their keys need the query image decoded and hashed.
+            plot_window.set_loading()
+            compute_worker.submit(query_index=last_index, settings=last_params, use_cache=reading_cache)
+        pending.discard(CHANGE_SETTINGS)
+        if CHANGE_RESULT in pending:
+            finished = compute_worker.poll_result()
+            pending.discard(CHANGE_RESULT)
+        if finished is not None:
+            request, plotted, error = finished
+            last_window_dimensions = plot_window.get_window_dimensions()
+            title = f'{base["filename"]} <-- {query.get_filename(request["query_index"])}'
+            if error is None:
+                controls_window.record_last_duration(plotted['duration'])
+                plot_window.set_plot_image(plotted['image'], title)
+            else:
+                # The previous plot stays, but the title tells it is not the requested one.
+                plot_window.set_title(f'{title} FAILED: {type(error).__name__}: {error}')
+            last_redraw = now
+            pending.discard(CHANGE_VIEW)
+            if not compute_worker.is_busy():
+                plot_window.unset_loading()
+            if not compute_worker.is_busy() and use_cache and error is None:
+                compute_worker.prefetch([
+                    {'query_index': index, 'settings': last_params}
+                    for index in get_neighbour_indices(last_index, len(query), prefetch_distance)
+                ])
+        elif last_window_dimensions is not None and last_window_dimensions != plot_window.get_window_dimensions():
             last_window_dimensions = plot_window.get_window_dimensions()
             plot_window.redraw()
-        key = cv2.waitKeyEx(1)  # TODO: There has to be a better and more performant way to detect resizes
+            last_redraw = now
+        elif CHANGE_VIEW in pending and now - last_redraw >= 1.0 / MAX_REDRAWS_PER_SECOND:
+            # Pans and zooms in between are merged into this single redraw.
+            plot_window.redraw_if_needed()
+            last_redraw = now
+            pending.discard(CHANGE_VIEW)
+        # OpenCV only handles window events while waiting for keys, so waiting cannot be left to the queue alone.
+        active = len(pending) > 0 or now - last_activity < ACTIVE_SECONDS or compute_worker.is_busy()
+        key = cv2.waitKeyEx(WAIT_ACTIVE_MS if active else WAIT_IDLE_MS)
+        if key >= 0:
+            pending.add(CHANGE_SETTINGS)
         if key in [KEY_LEFT_ARROW, KEY_PG_UP, KEY_UP_ARROW]:
             query_index_ref['query_index'] = (query_index_ref['query_index'] - 1) % len(query)
         elif key in [KEY_BOTTOM_ARROW, KEY_PG_DOWN, KEY_RIGHT_ARROW, KEY_SPACE]:
@@ -158,6 +306,7 @@ def run_plots(plot_window, controls_window, base, query, query_index_ref, settin
         elif key in [KEY_F5, ord('R'), ord('r')]:
             last_index = None
             last_params = None
+            reprocessing = True
         elif key in [KEY_F1, ord('?'), ord('H'), ord('h')]:
             print('====================================================')
             print('HELP')
@@ -169,6 +318,7 @@ def run_plots(plot_window, controls_window, base, query, query_index_ref, settin
             print('====================================================')
         elif key >= 0:
             print('invalid key pressed:', key, '. Press F1 for help.')
+    compute_worker.stop()
     controls_window.destroy()
     plot_window.destroy()
 
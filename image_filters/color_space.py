@@ -1,4 +1,5 @@
 import cv2
+import weakref
 
 
 COLOR_BGR = 'BGR'
@@ -8,6 +9,24 @@ COLOR_PARAM_SPECS = {
     'color_space': {'type': str, 'options': [COLOR_BGR, COLOR_BW], 'default': COLOR_BGR},
 }
 
+COLOR_CONVERSIONS = {
+    COLOR_BW: cv2.COLOR_BGR2GRAY,
+}
+
+# Already available conversions of BGR images (e.g. read from a disk cache), by image object and color space.
+_conversions = {}
+
 
 def change_color_space_from_bgr(color_space: str, images: list) -> list:
-    return images if color_space == COLOR_BGR else [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) for image in images]
+    return images if color_space == COLOR_BGR else [convert_from_bgr(color_space, image) for image in images]
+
+
+def convert_from_bgr(color_space: str, image):
+    converted = _conversions.get((id(image), color_space))
+    return cv2.cvtColor(image, COLOR_CONVERSIONS[color_space]) if converted is None else converted
+
+
+def register_conversion(image, color_space: str, converted_image):
+    key = (id(image), color_space)
+    _conversions[key] = converted_image
+    weakref.finalize(image, _conversions.pop, key, None)
@@ -0,0 +1,117 @@
+import cv2
+import hashlib
+import numpy
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from caching import LRUCache, MEGABYTE, register_cache
+from image_filters.color_space import COLOR_BGR, COLOR_BW, convert_from_bgr, register_conversion
+
+
+# Decoded images, by filename.
+IMAGE_CACHE = register_cache('images', LRUCache(1024 * MEGABYTE))
+
+# Color space versions stored in the disk cache, along with the decoded (BGR) images.
+DISK_CACHE_COLOR_SPACES = [COLOR_BW]
+
+_disk_cache = {'directory': None}
+
+
+def _disk_cache_path(filename: str, color_space: str):
+    stat = os.stat(filename)
+    digest = hashlib.blake2b(f'{os.path.abspath(filename)}|{stat.st_mtime_ns}|{stat.st_size}'.encode(),
+                             digest_size=16).hexdigest()
+    return os.path.join(_disk_cache['directory'], f'{digest}.{color_space}.npy')
+
+
+def _read_disk_cache(filename: str):
+    path = _disk_cache_path(filename, COLOR_BGR)
+    if not os.path.isfile(path):
+        return None
+    # Memory-mapped, so that nothing is actually read until used (and pages are shared between processes).
+    image = numpy.load(path, mmap_mode='r')
+    if len(image.shape) > 2:
+        for color_space in DISK_CACHE_COLOR_SPACES:
+            converted_path = _disk_cache_path(filename, color_space)
+            if os.path.isfile(converted_path):
+                register_conversion(image, color_space, numpy.load(converted_path, mmap_mode='r'))
+    return image
+
+
+def _write_disk_cache(filename: str, image):
+    arrays = {COLOR_BGR: image}
+    if len(image.shape) > 2 and image.shape[2] == 3:
+        for color_space in DISK_CACHE_COLOR_SPACES:
+            arrays[color_space] = convert_from_bgr(color_space, image)
+            register_conversion(image, color_space, arrays[color_space])
+    # Converted versions go first, as the BGR file is the one that marks the entry as complete.
+    for color_space in reversed(list(arrays.keys())):
+        path = _disk_cache_path(filename, color_space)
+        # Written under a temporary name, so that concurrent readers (e.g. batch workers) never see partial files.
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            numpy.save(f, arrays[color_space])
+        os.replace(temporary_path, path)
+
+
+class ImageCollection:
+    # Images are only decoded when first accessed (or preloaded), so that the collection size does not matter.
+    def __init__(self, filenames: list[str], threads: int = None):
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._filenames = filenames
+        self._loading = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, index: int):
+        return {'filename': self._filenames[index], 'image': self.get_image(index)}
+
+    def __len__(self):
+        return len(self._filenames)
+
+    def _get_future(self, filename: str):
+        with self._lock:
+            future = self._loading.get(filename)
+            if future is None:
+                future = self._executor.submit(load_image, filename)
+                self._loading[filename] = future
+                future.add_done_callback(lambda _: self._forget(filename))
+            return future
+
+    def _forget(self, filename: str):
+        with self._lock:
+            self._loading.pop(filename, None)
+
+    def destroy(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_filename(self, index: int):
+        return self._filenames[index]
+
+    def get_image(self, index: int):
+        image = IMAGE_CACHE.get(self._filenames[index])
+        return self._get_future(self._filenames[index]).result() if image is None else image
+
+    def preload(self, indices: list[int]):
+        for index in indices:
+            if IMAGE_CACHE.get(self._filenames[index]) is None:
+                self._get_future(self._filenames[index])
+
+
+def load_image(filename: str):
+    image = IMAGE_CACHE.get(filename)
+    if image is None:
+        image = None if _disk_cache['directory'] is None else _read_disk_cache(filename)
+        if image is None:
+            image = cv2.imread(filename, -1)
+            if image is None:
+                raise Exception(f'Image file {filename} could not be read.')
+            if _disk_cache['directory'] is not None:
+                _write_disk_cache(filename, image)
+        IMAGE_CACHE.put(filename, image, image.nbytes)
+    return image
+
+
+def set_disk_cache_directory(directory: str = None):
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    _disk_cache['directory'] = directory
@@ -0,0 +1,44 @@
+def fill_param_algorithm(algorithm: str, result: dict) -> None:
+    if algorithm not in result:
+        result[algorithm] = {'algorithm': algorithm}
+    elif 'algorithm' not in result[algorithm]:
+        result[algorithm]['algorithm'] = algorithm
+    elif result[algorithm]['algorithm'] != algorithm:
+        raise Exception(f'Algorithm mismatch in configuration file.')
+
+
+def fill_param_blanks(parameter_specs: dict, config_params: dict) -> dict:
+    result = config_params.copy()
+    for algorithm, conditionals in parameter_specs.items():
+        fill_param_algorithm(algorithm, result)
+        for conditional in conditionals:
+            for condition, params in conditional.items():
+                if condition == '':
+                    for specs in params.values():
+                        fill_param_blanks_shallow(algorithm, specs, result[algorithm])
+                elif condition not in result[algorithm]:
+                    # This should never happen, due to the checks we make PARAMETER_SPECS pass.
+                    raise Exception(f'Invalid dependency in settings: "{algorithm}"."{condition}"')
+                else:
+                    for condition_value, specs in params.items():
+                        if result[algorithm][condition] == condition_value:
+                            fill_param_blanks_shallow(algorithm, specs, result[algorithm])
+                    for condition_value, specs in params.items():
+                        if result[algorithm][condition] != condition_value:
+                            fill_param_blanks_shallow(algorithm, specs, result[algorithm])
+    return result
+
+
+def fill_param_blanks_shallow(algorithm: str, specs: dict, config_params: dict) -> None:
+    for key, spec in specs.items():
+        if key in config_params:
+            if config_params[key] is None:
+                if 'nullable' not in spec or not spec['nullable']:
+                    raise Exception(f'Configuration value for "{algorithm}"."{key}" cannot be null/None.')
+                del config_params[key]
+            elif type(config_params[key]) != spec['type']:
+                raise Exception(f'Configuration type for "{algorithm}"."{key}" has an invalid type.')
+            elif 'options' in spec and config_params[key] not in spec['options']:
+                raise Exception(f'Configuration value for "{algorithm}"."{key}" is invalid (not in available options).')
+        elif spec['default'] is not None:
+            config_params[key] = spec['default']
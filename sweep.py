@@ -0,0 +1,261 @@
+import argparse
+import cv2
+import itertools
+import json
+import numpy
+import os
+import sys
+import time
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from algorithms import PARAMETER_SPECS
+from algorithms.feature_matching.pools import clear_pools
+from algorithms.region import REGION_PARAM_SPECS
+from batch import find_all, prepare
+from caching import clear_caches
+from images import load_image
+from settings import fill_param_blanks
+from utils import get_iou, print_traceback
+
+
+GROUND_TRUTH_FILENAME = 'tests/ground-truth.yaml'
+MODE_GRID = 'grid'
+MODE_RANDOM = 'random'
+MODES = [MODE_GRID, MODE_RANDOM]
+OVERALL_CLASS = 'overall'
+
+DEFAULT_GRID_POINTS = 3
+DEFAULT_MAX_COMBINATIONS = 1000
+DEFAULT_SAMPLES = 50
+# A template counts as found when its best match overlaps the ground truth box by at least this much (IoU).
+FOUND_IOU_THRESHOLD = 0.5
+# In random mode, nullable parameters are left unset (i.e. to OpenCV's own defaults) this often.
+NULL_PROBABILITY = 0.25
+
+# Per worker process state, set up once by the pool initializer.
+_worker_state = {}
+
+
+def _draw_value(spec: dict, random):
+    if spec.get('nullable') and random.random() < NULL_PROBABILITY:
+        return None
+    if 'options' in spec:
+        return spec['options'][random.integers(0, len(spec['options']))]
+    if spec['type'] == bool:
+        return bool(random.integers(0, 2))
+    if 'min' not in spec:
+        return spec['default']
+    if 'step' in spec:
+        steps = int(round((spec['max'] - spec['min']) / spec['step']))
+        return _snap(spec, spec['min'] + spec['step'] * int(random.integers(0, steps + 1)))
+    return _snap(spec, random.uniform(spec['min'], spec['max']))
+
+
+def _evaluate(settings: dict):
+    base_image, templates = _worker_state['base'], _worker_state['templates']
+    # Every combination starts cold, so that its latency does not depend on what the worker evaluated before it.
+    clear_caches()
+    clear_pools()
+    try:
+        start = time.perf_counter()
+        prepared_base = prepare(base_image, settings)
+        preparation = time.perf_counter() - start
+    except:
+        # Some combinations are simply invalid for OpenCV (e.g. detector parameters out of their actual ranges).
+        print_traceback(sys.exc_info())
+        return {'settings': settings, 'failed': True}
+    results = []
+    for template in templates:
+        try:
+            found = find_all(base_image, [template['image']], settings, prepared_base=prepared_base)[0]
+            iou = get_iou(found['matches'][0]['box'], template['box']) if len(found['matches']) > 0 else 0.0
+            # The base is prepared once for all the templates (as in batch mode), so each one pays its share of it.
+            latency = found['duration']['total'] + preparation / len(templates)
+        except:
+            # E.g. too few keypoints on the template, which counts as not having found it.
+            print_traceback(sys.exc_info())
+            iou, latency = 0.0, None
+        results.append({'query': template['query'], 'class': template['class'], 'iou': iou, 'latency': latency})
+    classes = {OVERALL_CLASS: results}
+    for result in results:
+        classes.setdefault(result['class'], []).append(result)
+    metrics = {}
+    for name, class_results in classes.items():
+        latencies = [result['latency'] for result in class_results if result['latency'] is not None]
+        if len(latencies) > 0:
+            metrics[name] = {
+                'accuracy': sum(result['iou'] >= FOUND_IOU_THRESHOLD for result in class_results) / len(class_results),
+                'mean_iou': sum(result['iou'] for result in class_results) / len(class_results),
+                'latency': sum(latencies) / len(latencies),
+            }
+    return {'settings': settings, 'failed': len(metrics) == 0, 'preparation': preparation, 'results': results,
+            'classes': metrics}
+
+
+def _get_grid_values(spec: dict, grid_points: int):
+    if 'options' in spec:
+        values = list(spec['options'])
+    elif spec['type'] == bool:
+        values = [False, True]
+    elif 'min' in spec:
+        values = [_snap(spec, value) for value in numpy.linspace(spec['min'], spec['max'], grid_points)]
+        values = sorted(set(values + ([] if spec['default'] is None else [spec['default']])))
+    else:
+        values = [spec['default']]
+    return values + [None] if spec.get('nullable') else values
+
+
+def _init_worker(ground_truth: dict, opencv_threads: int):
+    cv2.setNumThreads(opencv_threads)
+    _worker_state['base'] = load_image(ground_truth['base'])
+    _worker_state['templates'] = [dict(template, image=load_image(template['query']))
+                                  for template in ground_truth['templates']]
+
+
+def _snap(spec: dict, value):
+    if 'step' in spec:
+        value = spec['min'] + round((value - spec['min']) / spec['step']) * spec['step']
+    value = min(max(value, spec['min']), spec['max'])
+    # Rounded, so that float steps do not leave values such as 0.30000000000000004 behind.
+    return int(round(value)) if spec['type'] == int else round(float(value), 10)
+
+
+def _walk(conditionals: list[dict], state: dict, swept: list[str], get_values):
+    if len(conditionals) == 0:
+        yield state
+        return
+    (condition, branches), = conditionals[0].items()
+    # Only the branch selected by the values chosen so far is walked, so every combination is a valid one.
+    specs = next(iter(branches.values())) if condition == '' else branches.get(state.get(condition), {})
+    keys = [key for key in specs if key in swept]
+    for values in itertools.product(*[get_values(specs[key]) for key in keys]):
+        combination = dict(state)
+        for key, value in zip(keys, values):
+            if value is None:
+                combination.pop(key, None)
+            else:
+                combination[key] = value
+        yield from _walk(conditionals[1:], combination, swept, get_values)
+
+
+def get_args():
+    ap = argparse.ArgumentParser(description='Sweeps algorithm parameters over templates with known locations, '
+                                             'reporting the latency/accuracy Pareto front of every template class.')
+    ap.add_argument('-a', '--algorithms', nargs='+', choices=PARAMETER_SPECS['algorithms'],
+                    help='Algorithms to sweep (default: the one in the configuration file)')
+    ap.add_argument('-c', '--config', default='config.yaml', help='Configuration file, for the values of the '
+                                                                  'parameters not being swept (default: config.yaml)')
+    ap.add_argument('-g', '--ground-truth', default=GROUND_TRUTH_FILENAME,
+                    help=f'Ground truth file (default: {GROUND_TRUTH_FILENAME})')
+    ap.add_argument('--grid-points', type=int, default=DEFAULT_GRID_POINTS,
+                    help=f'Grid mode values per numerical parameter (default: {DEFAULT_GRID_POINTS})')
+    ap.add_argument('--max-combinations', type=int, default=DEFAULT_MAX_COMBINATIONS,
+                    help=f'Grid mode combination limit (default: {DEFAULT_MAX_COMBINATIONS})')
+    ap.add_argument('-m', '--mode', choices=MODES, default=MODE_GRID, help=f'Sweep mode (default: {MODE_GRID})')
+    ap.add_argument('-o', '--output', default='sweep.json', help='Results filename (default: sweep.json)')
+    ap.add_argument('-p', '--processes', type=int, help='Worker process count (default: CPU count; 1 for the most '
+                                                        'reliable latencies)')
+    ap.add_argument('--samples', type=int, default=DEFAULT_SAMPLES,
+                    help=f'Random mode combination count (default: {DEFAULT_SAMPLES})')
+    ap.add_argument('--seed', type=int, default=0, help='Random mode seed (default: 0)')
+    ap.add_argument('-s', '--sweep', nargs='+', help='Parameters to sweep (default: all but the region of interest '
+                                                      'ones)')
+    args = vars(ap.parse_args())
+    with open(args['config'], 'r', encoding='utf-8') as f:
+        args['parameters'] = yaml.load(f.read(), yaml.Loader).get('parameters') or {}
+    with open(args['ground_truth'], 'r', encoding='utf-8') as f:
+        args['ground_truth'] = yaml.load(f.read(), yaml.Loader)
+    assert 'base' in args['ground_truth'] and len(args['ground_truth'].get('templates', [])) > 0, \
+        'Ground truth needs a base and templates.'
+    if args['algorithms'] is None:
+        args['algorithms'] = list(args['parameters'].keys())[:1] or ['Match Template']
+    assert args['grid_points'] > 1, 'Grid points must be more than one.'
+    assert args['max_combinations'] > 0, 'Combination limit must be positive.'
+    assert args['processes'] is None or args['processes'] > 0, 'Process count must be positive.'
+    assert args['samples'] > 0, 'Sample count must be positive.'
+    return args
+
+
+def get_combinations(algorithm: str, settings: dict, swept: list[str] = None, mode: str = MODE_GRID,
+                     grid_points: int = DEFAULT_GRID_POINTS, samples: int = DEFAULT_SAMPLES,
+                     max_combinations: int = DEFAULT_MAX_COMBINATIONS, seed: int = 0):
+    conditionals = PARAMETER_SPECS['parameters'][algorithm]
+    if swept is None:
+        # Regions of interest are part of the input (as ground truth boxes are), not of the algorithm.
+        swept = [name for name in get_parameter_names(algorithm) if name not in REGION_PARAM_SPECS]
+    if mode == MODE_GRID:
+        combinations = list(itertools.islice(_walk(conditionals, settings, swept,
+                                                   partial(_get_grid_values, grid_points=grid_points)),
+                                             max_combinations + 1))
+        if len(combinations) > max_combinations:
+            raise Exception(f'The "{algorithm}" grid has more than {max_combinations} combinations. Sweep fewer '
+                            'parameters, use fewer grid points or sample at random instead.')
+        return combinations
+    random = numpy.random.default_rng(seed)
+    combinations = {}
+    for _ in range(samples):
+        combination = next(_walk(conditionals, settings, swept, lambda spec: [_draw_value(spec, random)]))
+        combinations[json.dumps(combination, sort_keys=True)] = combination
+    return list(combinations.values())
+
+
+def get_pareto_fronts(evaluations: list[dict]):
+    fronts = {}
+    for index, evaluation in enumerate(evaluations):
+        if not evaluation['failed']:
+            for name, metrics in evaluation['classes'].items():
+                # Finding nothing at all is not a trade-off, however fast.
+                if metrics['mean_iou'] > 0:
+                    fronts.setdefault(name, []).append({'index': index, **metrics})
+    for name, points in fronts.items():
+        # Fastest first: a combination is only on the front if it is more accurate than every faster one.
+        front = []
+        for point in sorted(points, key=lambda p: (p['latency'], -p['accuracy'], -p['mean_iou'])):
+            if len(front) == 0 or (point['accuracy'], point['mean_iou']) > (front[-1]['accuracy'],
+                                                                            front[-1]['mean_iou']):
+                front.append(point)
+        fronts[name] = front
+    return fronts
+
+
+def get_parameter_names(algorithm: str):
+    return [key for conditional in PARAMETER_SPECS['parameters'][algorithm]
+            for branches in conditional.values() for specs in branches.values() for key in specs]
+
+
+def main():
+    args = get_args()
+    for key in args['sweep'] or []:
+        assert any(key in get_parameter_names(algorithm) for algorithm in args['algorithms']), \
+            f'Unknown parameter "{key}" for algorithms {args["algorithms"]}.'
+    settings = fill_param_blanks(PARAMETER_SPECS['parameters'], args['parameters'])
+    combinations = [combination for algorithm in args['algorithms']
+                    for combination in get_combinations(algorithm, settings[algorithm], args['sweep'], args['mode'],
+                                                        args['grid_points'], args['samples'],
+                                                        args['max_combinations'], args['seed'])]
+    print(f'Evaluating {len(combinations)} combinations over {len(args["ground_truth"]["templates"])} templates...')
+    evaluations = run_sweep(args['ground_truth'], combinations, args['processes'])
+    fronts = get_pareto_fronts(evaluations)
+    with open(args['output'], 'w', encoding='utf-8') as f:
+        json.dump({'evaluations': evaluations, 'fronts': fronts}, f, indent=4)
+    for name, front in fronts.items():
+        print(f'{name}:')
+        for point in front:
+            print(f'    {point["latency"] * 1000:.1f} ms, {point["accuracy"] * 100:.0f}% found '
+                  f'(mean IoU {point["mean_iou"]:.2f}): {json.dumps(evaluations[point["index"]]["settings"])}')
+    failed = sum(evaluation['failed'] for evaluation in evaluations)
+    print(f'{len(evaluations)} combinations evaluated ({failed} failed). Results written to {args["output"]}.')
+
+
+def run_sweep(ground_truth: dict, combinations: list[dict], processes: int = None):
+    processes = os.cpu_count() if processes is None else processes
+    # With several workers, OpenCV's own thread pool only oversubscribes the cores.
+    opencv_threads = 1 if processes > 1 else -1
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(ground_truth, opencv_threads)) as executor:
+        return list(executor.map(_evaluate, combinations))
+
+
+if __name__ == '__main__':
+    main()
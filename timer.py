@@ -1,4 +1,13 @@
+import json
+import os
+import threading
 import time
+from contextlib import contextmanager
+
+
+# Trace events (Chrome trace-event format) recorded by every timer in this process, once tracing has been enabled.
+_trace = {'enabled': False, 'events': []}
+_trace_lock = threading.Lock()
 
 
 class TimerError(Exception):
@@ -8,25 +17,32 @@ class TimerError(Exception):
 class Timer:
     RESERVED = ['partial', 'total']
 
-    def __init__(self):
+    def __init__(self, name: str = None, **metadata):
         self._first = None
         self._last = None
+        self._last_time = None
+        self._metadata = metadata
+        self._name = name
         self._start_time = None
         self._times = {}
 
     def current_total(self):
         return time.perf_counter() - self._start_time
 
-    def mark(self, name: str):
+    def add_metadata(self, **metadata):
+        self._metadata.update(metadata)
+
+    def mark(self, name: str, **metadata):
         if name in Timer.RESERVED:
             raise TimerError(f'Mark name "{name}" not allowed.')
 
-        self._times[name] = time.perf_counter() - self._start_time
-        if self._last:
-            self._times[name] -= self._times[self._last]
-        else:
+        now = time.perf_counter()
+        record_trace_event(name, self._last_time, now, metadata)
+        self._times[name] = now - self._last_time
+        if not self._last:
             self._first = name
         self._last = name
+        self._last_time = now
 
     def partial(self):
         partial_time = self.current_total()
@@ -36,16 +52,52 @@ class Timer:
         partial_times['partial'] = partial_time
         return partial_times
 
+    @contextmanager
+    def span(self, name: str, **metadata):
+        # Spans do not show up in the durations, only in traces (nested within the ones that contain them).
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record_trace_event(name, start, time.perf_counter(), metadata)
+
     def start(self):
         self._first = None
         self._last = None
         self._times = {}
         self._start_time = time.perf_counter()
+        self._last_time = self._start_time
 
     def stop(self, add_tail: bool = False):
+        if self._name is not None:
+            record_trace_event(self._name, self._start_time, time.perf_counter(), self._metadata)
         if add_tail:
             self._times['total'] = self.current_total()
         else:
             self._times['total'] = 0.0
             self._times['total'] = sum(self._times.values())
         return self._times.copy()
+
+
+def drain_trace_events():
+    with _trace_lock:
+        events, _trace['events'] = _trace['events'], []
+    return events
+
+
+def enable_tracing(enabled: bool = True):
+    _trace['enabled'] = enabled
+
+
+def record_trace_event(name: str, start: float, end: float, metadata: dict = None):
+    if _trace['enabled']:
+        # perf_counter is system-wide (monotonic clock), so events from different processes line up.
+        event = {'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': (end - start) * 1e6, 'pid': os.getpid(),
+                 'tid': threading.get_native_id(), 'args': metadata or {}}
+        with _trace_lock:
+            _trace['events'].append(event)
+
+
+def write_chrome_trace(events: list[dict], filename: str):
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
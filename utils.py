@@ -29,6 +29,13 @@ def flat_map(xs):
     return ys
 
 
+def get_iou(box_a: list[int], box_b: list[int]):
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    intersection = max(min(ax + aw, bx + bw) - max(ax, bx), 0) * max(min(ay + ah, by + bh) - max(ay, by), 0)
+    return intersection / (aw * ah + bw * bh - intersection)
+
+
 def plot_empty_match(base_image, query_image):
     bh, bw = base_image.shape[:2]
     qh, qw = query_image.shape[:2]